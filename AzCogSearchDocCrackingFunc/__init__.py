@@ -1,6 +1,5 @@
 import logging
 import json
-import re
 import azure.functions as func
 import os
 from azure.cosmos import CosmosClient, PartitionKey
@@ -8,26 +7,21 @@ from azure.storage.blob import ContainerClient
 import urllib
 import uuid
 import copy
+from multiprocessing.dummy import Pool as ThreadPool
 
 from utils import cosmos_helpers
 from utils import storage
 from utils import cv_helpers
+from utils import text_cleaning
 
 from utils.env_vars import *
 
 
-def remove_urls(text):
-    text = re.sub(r'(https|http)?:\/\/(\w|\.|\/|\?|\=|\&|\%)*\b', '', text, flags=re.MULTILINE)
-    return text
 
-re_strs = [
-    "customXml\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*", 
-    "ppt\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*",
-    "\.MsftOfcThm_[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*[\r\n\t\f\v ]\{[\r\n\t\f\v ].*[\r\n\t\f\v ]\}",
-    "SlidePowerPoint",
-    "PresentationPowerPoint",
-    '[a-zA-Z0-9]*\.(?:gif|emf)'
-    ]
+
+## records of a skill batch are processed by record_pool, the Cosmos and blob writes of a record overlap in io_pool
+record_pool = ThreadPool(SKILL_RECORD_CONCURRENCY)
+io_pool = ThreadPool(SKILL_RECORD_CONCURRENCY)
 
 
 
@@ -36,7 +30,7 @@ def analyze_doc(data_dict):
     ret_dict = {}
     ret_dict['status'] = ''
     db_status = ''
-    data_dict['text'] = remove_urls(data_dict['content'].replace("\n\n\n", "\n").replace("....", "."))
+    data_dict['text'] = text_cleaning.remove_urls(data_dict['content'].replace("\n\n\n", "\n").replace("....", "."))
     data_dict['contentType'] = 'text'
     data_dict['container'] = storage.get_container_name(data_dict['doc_url'])
 
@@ -48,9 +42,7 @@ def analyze_doc(data_dict):
 
 
         
-    for re_str in re_strs:
-        matches = re.findall(re_str, data_dict['text'], re.DOTALL)
-        for m in matches: data_dict['text'] = data_dict['text'].replace(m, '')
+    data_dict['text'] = text_cleaning.clean_office_text(data_dict['text'])
 
 
     try:
@@ -78,20 +70,22 @@ def analyze_doc(data_dict):
         ret_dict['status'] = f"Exception: Image {doc_id} created an exception.\n{e}"
 
 
+    cosmos_result = io_pool.apply_async(cosmos_helpers.cosmos_store_contents, (data_dict,)) if DATABASE_MODE == 1 else None
+
     try:
-        if DATABASE_MODE == 1:
-            db_status = cosmos_helpers.cosmos_store_contents(data_dict)
-            logging.info(db_status)
-            print(db_status)
-    except Exception as e:    
+        ret_dict = storage.save_json_document(data_dict, OUTPUT_BLOB_CONTAINER)
+        logging.info(ret_dict['status'])
+    except Exception as e:
         doc_id = data_dict.get('id', 'Unknown ID')
         logging.error(f"Exception: Document {doc_id} created an exception.\n{e}")
         ret_dict['status'] = ret_dict['status'] + '\n' + f"Exception: Document {doc_id} created an exception.\n{e}"
 
     try:
-        ret_dict = storage.save_json_document(data_dict, OUTPUT_BLOB_CONTAINER)
-        logging.info(ret_dict['status'])
-    except Exception as e:
+        if cosmos_result is not None:
+            db_status = cosmos_result.get()
+            logging.info(db_status)
+            print(db_status)
+    except Exception as e:    
         doc_id = data_dict.get('id', 'Unknown ID')
         logging.error(f"Exception: Document {doc_id} created an exception.\n{e}")
         ret_dict['status'] = ret_dict['status'] + '\n' + f"Exception: Document {doc_id} created an exception.\n{e}"
@@ -147,6 +141,19 @@ def transform_value(value):
 
 
 
+def safe_transform_value(value):
+    ## a failing record must not fail the whole batch
+    try:
+        return transform_value(value)
+    except Exception as e:
+        logging.error(f"Exception: Record {value.get('recordId', 'Unknown')} created an exception.\n{e}")
+        return None if 'recordId' not in value else {
+            "recordId": value['recordId'],
+            "errors": [ { "message": f"Could not complete operation for record: {e}" } ]
+            }
+
+
+
 def compose_response(json_data):
     values = json.loads(json_data)['values']
     
@@ -154,8 +161,8 @@ def compose_response(json_data):
     results = {}
     results["values"] = []
     
-    for value in values:
-        output_record = transform_value(value)
+    ## map keeps the records in the order the indexer sent them
+    for output_record in record_pool.map(safe_transform_value, values):
         if output_record != None:
             results["values"].append(output_record)
 
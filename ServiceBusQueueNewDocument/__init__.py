@@ -1,13 +1,12 @@
 import logging
 import json
 import azure.functions as func
-import smart_open
-import os, uuid
-from azure.storage.blob import BlobServiceClient, BlobClient
+import os
 
 from utils import helpers
-from utils import cosmos_helpers
-from utils import cogsearch_helpers
+from utils import ingestion_pipeline
+from utils import incremental_index
+from utils import storage
 from utils.kb_doc import KB_Doc
 from utils.cogvecsearch_helpers import cogsearch_vecstore
 
@@ -21,46 +20,36 @@ def main(msg: func.ServiceBusMessage):
     logging.info('Python ServiceBus queue trigger processed message: %s', msg_dict)
     logging.info("Event Type:%s", msg_dict['eventType'])
 
-    transport_params = {
-    'client': BlobServiceClient.from_connection_string(KB_BLOB_CONN_STR),
-    }
-
     json_filename = os.path.basename(msg_dict['subject'])
-
-    with smart_open.open(f"azure://{OUTPUT_BLOB_CONTAINER}/{json_filename}", transport_params=transport_params) as fin:
-        data = json.load(fin)
+    data = storage.load_json_document(OUTPUT_BLOB_CONTAINER, json_filename)
 
     full_kbd_doc = KB_Doc()
     full_kbd_doc.load(data)
 
-    emb_documents = []
-
-    emb_documents += helpers.generate_embeddings(full_kbd_doc, CHOSEN_EMB_MODEL, SMALL_EMB_TOKEN_NUM,  text_suffix = 'S')
-
-    if MEDIUM_EMB_TOKEN_NUM != 0:
-        emb_documents += helpers.generate_embeddings(full_kbd_doc, CHOSEN_EMB_MODEL, MEDIUM_EMB_TOKEN_NUM, text_suffix = 'M', previous_max_tokens=SMALL_EMB_TOKEN_NUM)
+    if USE_COG_VECSEARCH == 1:
+        vs = cogsearch_vecstore.CogSearchVecStore()
+        vs.ensure_index()
 
-    if LARGE_EMB_TOKEN_NUM != 0:
-        emb_documents += helpers.generate_embeddings(full_kbd_doc, CHOSEN_EMB_MODEL, LARGE_EMB_TOKEN_NUM,  text_suffix = 'L', previous_max_tokens=MEDIUM_EMB_TOKEN_NUM)
+    doc_id = data['id']
+    filename = data.get('filename', '')
+    if (filename is None) or (filename == '') or (filename == 'null'): filename = storage.get_filename(data.get('doc_url', ''))
+    container = data.get('container', KB_BLOB_CONTAINER)
 
-    if X_LARGE_EMB_TOKEN_NUM != 0:
-        emb_documents += helpers.generate_embeddings(full_kbd_doc, CHOSEN_EMB_MODEL, X_LARGE_EMB_TOKEN_NUM,  text_suffix = 'XL', previous_max_tokens=LARGE_EMB_TOKEN_NUM)
+    if USE_ASYNC_INGESTION == 1:
+        if INCREMENTAL_INDEXING == 1:
+            stats = incremental_index.update_document_index_async(full_kbd_doc, doc_id, filename, container, CHOSEN_EMB_MODEL, document_name = json_filename)
+        else:
+            stats = ingestion_pipeline.ingest_documents([full_kbd_doc], CHOSEN_EMB_MODEL)
 
-    logging.info(f"Generated {len(emb_documents)} emb chunks from doc {json_filename}")
+        logging.info(f"Ingested doc {json_filename} through the async pipeline: {stats}")
+        return
 
-    if (REDIS_ADDR is not None) and (REDIS_ADDR != ''): 
-        loaded = helpers.load_embedding_docs_in_redis(emb_documents, document_name = json_filename)
-        logging.info(f"Loaded into Redis {loaded} emb chunks from doc {json_filename}")
-        print(f"Loaded into Redis {loaded} emb chunks from doc {json_filename}")
+    emb_stream = helpers.generate_tiered_embeddings_stream(full_kbd_doc, CHOSEN_EMB_MODEL)
 
-    if USE_COG_VECSEARCH == 1:
-        vs = cogsearch_vecstore.CogSearchVecStore()
-        vs.create_index()
-        docs_dict = vs.upload_documents(emb_documents)
+    if INCREMENTAL_INDEXING == 1:
+        stats = incremental_index.update_document_index(emb_stream, doc_id, filename, container, document_name = json_filename)
     else:
-        cogsearch_helpers.index_semantic_sections(emb_documents)
-
-    if DATABASE_MODE == 1:
-        cosmos_helpers.cosmos_backup_embeddings(emb_documents)
+        stats = ingestion_pipeline.write_stream_to_sinks(emb_stream, document_name = json_filename)
 
-    
\ No newline at end of file
+    logging.info(f"Generated {stats['chunks']} emb chunks from doc {json_filename}: {stats}")
+    print(f"Generated {stats['chunks']} emb chunks from doc {json_filename}: {stats}")
@@ -0,0 +1,118 @@
+import re
+import time
+import hashlib
+import threading
+import numpy as np
+
+from utils.env_vars import *
+
+
+## Final-answer cache of KMOAI_Agent.run, looked up by query embedding. Entries are scoped by agent type,
+## filter and conversation history, so a hit needs a near-identical question asked in the same context.
+## Entries expire after ANSWER_CACHE_TTL_SECS, the oldest are evicted beyond ANSWER_CACHE_MAX_ENTRIES.
+## Questions that differ only in a year or a name embed almost identically, so a hit also needs the same
+## guard tokens (numbers and capitalized words) as the cached question.
+
+
+
+def get_guard_tokens(query):
+    numbers = re.findall(r"\d+(?:[.,]\d+)*", query)
+    words = re.findall(r"\b[A-Za-z][\w&'-]*\b", query)
+    ## the first word is capitalized in any sentence, it says nothing about an entity
+    names = [w.lower() for w in words[1:] if any([c.isupper() for c in w])]
+    return frozenset(numbers + names)
+
+
+
+def get_scope(agent_name, filter_param, history):
+    history_hash = hashlib.sha256(' '.join((history or '').split()).encode('utf-8')).hexdigest()
+    return (agent_name, filter_param or '*', history_hash)
+
+
+
+class SemanticAnswerCache:
+
+    def __init__(self, threshold = ANSWER_CACHE_THRESHOLD, ttl = ANSWER_CACHE_TTL_SECS, max_entries = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.vectors = {}
+        self.stats = {'hits': 0, 'misses': 0, 'guard_misses': 0, 'evictions': 0}
+
+
+    def expire(self, now):
+        for scope in list(self.entries.keys()):
+            keep = [i for i, e in enumerate(self.entries[scope]) if e['expiry'] > now]
+            if len(keep) == len(self.entries[scope]): continue
+
+            self.stats['evictions'] += len(self.entries[scope]) - len(keep)
+            self.entries[scope] = [self.entries[scope][i] for i in keep]
+            self.vectors[scope] = self.vectors[scope][keep]
+            if len(keep) == 0: del self.entries[scope], self.vectors[scope]
+
+
+    def evict_oldest(self):
+        while sum([len(e) for e in self.entries.values()]) > self.max_entries:
+            scope = min(self.entries.keys(), key=lambda s: self.entries[s][0]['created'])
+            self.entries[scope] = self.entries[scope][1:]
+            self.vectors[scope] = self.vectors[scope][1:]
+            self.stats['evictions'] += 1
+            if len(self.entries[scope]) == 0: del self.entries[scope], self.vectors[scope]
+
+
+    def lookup(self, query_embedding, scope, guard = frozenset()):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+
+        with self.lock:
+            self.expire(time.time())
+
+            if scope not in self.entries:
+                self.stats['misses'] += 1
+                return None
+
+            scores = self.vectors[scope] @ query
+            candidates = [int(i) for i in np.argsort(-scores) if scores[i] >= self.threshold]
+
+            for i in candidates:
+                if self.entries[scope][i]['guard'] != guard: continue
+                self.stats['hits'] += 1
+                return {**self.entries[scope][i]['value'], 'similarity': float(scores[i])}
+
+            if len(candidates) > 0: self.stats['guard_misses'] += 1
+            self.stats['misses'] += 1
+            return None
+
+
+    def store(self, query_embedding, scope, value, guard = frozenset()):
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        vector = (vector / max(np.linalg.norm(vector), 1e-12)).reshape(1, -1)
+        now = time.time()
+
+        with self.lock:
+            self.expire(now)
+
+            if scope in self.entries:
+                self.entries[scope].append({'value': value, 'guard': guard, 'created': now, 'expiry': now + self.ttl})
+                self.vectors[scope] = np.concatenate([self.vectors[scope], vector])
+            else:
+                self.entries[scope] = [{'value': value, 'guard': guard, 'created': now, 'expiry': now + self.ttl}]
+                self.vectors[scope] = vector
+
+            self.evict_oldest()
+
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = sum([len(e) for e in self.entries.values()])
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+        return stats
+
+
+
+semantic_cache = SemanticAnswerCache()
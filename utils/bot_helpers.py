@@ -12,6 +12,7 @@ from utils import redis_helpers
 from utils import openai_helpers
 from utils import cosmos_helpers
 from utils import km_agents
+from utils import search_fanout
 
 from utils.env_vars import *
 
@@ -29,10 +30,12 @@ def openai_interrogate_text(query, session_id=None, filter_param=None, agent_nam
     if (agent_name is None) or (agent_name not in ['zs', 'ccr', 'os']):
         agent_name = 'zs'
 
-    agent = km_agents.KMOAI_Agent(agent_name = agent_name, params_dict=params_dict, verbose = False)
+    agent = km_agents.create_agent(agent_name = agent_name, params_dict = params_dict, verbose = False)
 
 
     final_answer, sources, likely_sources, session_id = agent.run(query, redis_conn, session_id, filter_param)
+    logging.info(f"Redis connection pool after the request: {redis_helpers.get_pool_stats()}")
+    logging.info(f"Search backend latencies over the last {FANOUT_LATENCY_WINDOW} calls: {search_fanout.get_latency_stats()}")
 
     if lang != 'en': 
         final_answer = language.translate(final_answer, 'en', lang)
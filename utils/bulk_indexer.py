@@ -0,0 +1,99 @@
+import json
+import time
+import random
+import logging
+from multiprocessing.dummy import Pool as ThreadPool
+
+from utils.env_vars import *
+
+
+## Cognitive Search accepts at most 1000 documents and 16 MB per indexing request.
+## Status codes worth retrying for a single key in a partially failed batch.
+RETRYABLE_STATUS_CODES = [409, 422, 429, 500, 503]
+
+## Retries are split by layer: a request that fails as a whole was already retried by the transport
+## (the tenacity retry of http_helpers, the Azure SDK retry policy), so it is only logged here; this class
+## retries just the keys that failed inside an otherwise successful request.
+##
+## Batches are uploaded in parallel only when one upload() call gets more than COG_SEARCH_BATCH_MAX_DOCS
+## documents, i.e. on the non-streaming path. The streaming sinks pass STREAM_BATCH_SIZE chunks per call,
+## which fit in one request; there the concurrency comes from the writers of the ingestion pipeline.
+
+
+
+class BulkIndexer:
+
+    def __init__(self, upload_func, max_docs = COG_SEARCH_BATCH_MAX_DOCS, max_bytes = COG_SEARCH_BATCH_MAX_BYTES,
+                       concurrency = COG_SEARCH_UPLOAD_CONCURRENCY, max_retries = COG_SEARCH_UPLOAD_RETRIES):
+
+        ## upload_func takes a list of documents and returns a list of (key, succeeded, status_code)
+        self.upload_func = upload_func
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+
+    def get_batches(self, documents):
+        batch = []
+        batch_bytes = 0
+
+        for doc in documents:
+            doc_bytes = len(json.dumps(doc))
+
+            if (len(batch) > 0) and ((len(batch) >= self.max_docs) or (batch_bytes + doc_bytes > self.max_bytes)):
+                yield batch
+                batch = []
+                batch_bytes = 0
+
+            batch.append(doc)
+            batch_bytes += doc_bytes
+
+        if len(batch) > 0:
+            yield batch
+
+
+    def upload_batch(self, batch):
+        pending = batch
+        succeeded = 0
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                results = self.upload_func(pending)
+            except Exception as e:
+                logging.error(f"Indexing batch of {len(pending)} documents failed after the transport retries: {e}")
+                break
+
+            failed_keys = set([key for key, ok, status_code in results if not ok and (status_code in RETRYABLE_STATUS_CODES)])
+            succeeded += sum([1 for _, ok, _ in results if ok])
+
+            for key, ok, status_code in results:
+                if not ok and (status_code not in RETRYABLE_STATUS_CODES):
+                    logging.error(f"Indexing document {key} failed with status {status_code}")
+
+            pending = [doc for doc in pending if doc['id'] in failed_keys]
+            if len(pending) == 0: break
+
+            if attempt < self.max_retries: time.sleep(min(2 ** attempt, 20) * random.random())
+
+        if len(pending) > 0:
+            logging.error(f"Giving up indexing {len(pending)} documents after {attempt} retries")
+
+        return succeeded
+
+
+    def upload(self, documents):
+        batches = list(self.get_batches(documents))
+        if len(batches) == 0: return 0
+
+        start = time.time()
+
+        pool = ThreadPool(max(1, min(len(batches), self.concurrency)))
+        succeeded = sum(pool.map(self.upload_batch, batches))
+        pool.close()
+        pool.join()
+
+        logging.info(f"Indexed {succeeded} of {len(documents)} documents in {len(batches)} batches in {time.time() - start:.2f}s")
+        print(f"\tIndexed {len(documents)} sections, {succeeded} succeeded")
+
+        return succeeded
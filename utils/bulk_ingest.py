@@ -0,0 +1,175 @@
+## Parallel, resumable bulk ingestion of processed JSON documents.
+##
+## python -m utils.bulk_ingest --container kmoaiprocessed --workers 4 --manifest backfill.manifest.jsonl
+## python -m utils.bulk_ingest --folder ./processed_json --workers 8 --output-dir ./chunks
+##
+## Workers take groups of --group-size documents and detect their languages in one Translator request;
+## every document is then chunked, embedded and written to the sinks, micro-batch by micro-batch. The
+## parent appends one line per finished document to the manifest, so a rerun with the same manifest skips
+## everything already done. A document is reported finished only after its sink writes returned,
+## including the flush of the numpy index.
+##
+## The worker pool is forked before the parent creates any Azure client, and every worker drops whatever
+## clients it inherited anyway (the pool re-forks dead workers later), so no two processes share a socket.
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from multiprocessing import Pool
+
+from utils.env_vars import *
+
+
+
+def init_worker():
+    from utils import lazy_init
+    lazy_init.reset_resources()
+
+    redis_helpers = sys.modules.get('utils.redis_helpers', None)
+    if redis_helpers is not None: redis_helpers.redis_pool = None
+
+
+
+def load_manifest(manifest):
+    done = set()
+    if not os.path.exists(manifest): return done
+
+    with open(manifest, 'r') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['name'])
+            except Exception:
+                continue
+
+    return done
+
+
+
+def list_source(folder = '', container = ''):
+    if folder != '':
+        return sorted([item for item in os.listdir(folder) if item.endswith('.json')])
+
+    from utils import storage
+    return sorted([storage.get_filename(url) for url in storage.list_documents(container)])
+
+
+
+def load_source_document(name, folder = '', container = ''):
+    if folder != '':
+        with open(os.path.join(folder, name), 'r') as openfile:
+            return json.load(openfile)
+
+    from utils import storage
+    return storage.load_json_document(container, name)
+
+
+
+def get_output_sink(output_dir, name):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, os.path.splitext(name)[0] + '.jsonl')
+    if os.path.exists(path): os.remove(path)
+
+    def write_chunks(emb_documents):
+        with open(path, 'a') as f:
+            for e in emb_documents: f.write(json.dumps(e) + '\n')
+        return len(emb_documents)
+
+    return [('file', write_chunks)]
+
+
+
+def ingest_group(args):
+    ## one Translator language detection request for the whole group, then one document at a time
+    names, folder, container, output_dir = args
+
+    from utils import helpers
+    from utils import ingestion_pipeline
+    from utils.kb_doc import KB_Doc
+
+    results = []
+    loaded = []
+
+    for name in names:
+        start = time.time()
+        try:
+            kbd_doc = KB_Doc()
+            kbd_doc.load(load_source_document(name, folder, container))
+            loaded.append((name, kbd_doc, start))
+        except Exception as e:
+            logging.error(f"Bulk ingestion of {name} failed: {e}")
+            results.append({'name': name, 'ok': False, 'error': str(e), 'secs': time.time() - start})
+
+    langs = helpers.detect_doc_languages([kbd_doc for _, kbd_doc, _ in loaded]) if len(loaded) > 0 else []
+
+    for (name, kbd_doc, start), lang in zip(loaded, langs):
+        try:
+            doc_stats = {}
+            sinks = get_output_sink(output_dir, name) if output_dir != '' else None
+            emb_stream = helpers.generate_tiered_embeddings_stream(kbd_doc, CHOSEN_EMB_MODEL, lang = lang, stats = doc_stats)
+            stats = ingestion_pipeline.write_stream_to_sinks(emb_stream, sinks, document_name = name)
+
+            results.append({'name': name, 'ok': True, 'chunks': stats['chunks'], 'tokens': doc_stats.get('tokens', 0), 'secs': time.time() - start})
+
+        except Exception as e:
+            logging.error(f"Bulk ingestion of {name} failed: {e}")
+            results.append({'name': name, 'ok': False, 'error': str(e), 'secs': time.time() - start})
+
+    return results
+
+
+
+def bulk_ingest(folder = '', container = OUTPUT_BLOB_CONTAINER, manifest = 'bulk_ingest.manifest.jsonl', workers = 4, output_dir = '', limit = -1, group_size = 16):
+
+    with Pool(workers, initializer=init_worker) as pool, open(manifest, 'a') as manifest_file:
+        ## listing the container creates the blob client, only after the workers are forked
+        done = load_manifest(manifest)
+        names = [n for n in list_source(folder, container) if n not in done]
+        if limit != -1: names = names[:limit]
+
+        print(f"Bulk ingestion: {len(done)} documents already done, {len(names)} to go with {workers} workers")
+
+        totals = {'docs': 0, 'failed': 0, 'chunks': 0, 'tokens': 0}
+        start = time.time()
+
+        groups = [(names[i:i+group_size], folder, container, output_dir) for i in range(0, len(names), group_size)]
+        results = (r for group_results in pool.imap_unordered(ingest_group, groups) for r in group_results)
+
+        for r in results:
+            if not r['ok']:
+                totals['failed'] += 1
+                print(f"Failed {r['name']}: {r['error']}")
+                continue
+
+            manifest_file.write(json.dumps(r) + '\n')
+            manifest_file.flush()
+
+            totals['docs'] += 1
+            totals['chunks'] += r['chunks']
+            totals['tokens'] += r['tokens']
+
+            elapsed = max(time.time() - start, 1e-6)
+            print(f"Done {r['name']} ({r['chunks']} chunks) -- {totals['docs']}/{len(names)} docs, {totals['docs'] / elapsed:.2f} docs/s, {totals['tokens'] / elapsed:.0f} tokens/s")
+
+    totals['elapsed_secs'] = time.time() - start
+    logging.info(f"Bulk ingestion finished: {totals}")
+    print(f"Bulk ingestion finished: {totals}")
+
+    return totals
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel, resumable ingestion of processed JSON documents')
+    parser.add_argument('--folder', default='', help='local folder of processed JSON documents')
+    parser.add_argument('--container', default=OUTPUT_BLOB_CONTAINER, help='blob container of processed JSON documents, used when --folder is not given')
+    parser.add_argument('--manifest', default='bulk_ingest.manifest.jsonl')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output-dir', default='', help='write chunks as JSON lines here instead of the configured sinks')
+    parser.add_argument('--limit', type=int, default=-1)
+    parser.add_argument('--group-size', type=int, default=16, help='documents per worker task, their languages are detected in one request')
+    args = parser.parse_args()
+
+    bulk_ingest(args.folder, args.container, args.manifest, args.workers, args.output_dir, args.limit, args.group_size)
@@ -0,0 +1,78 @@
+import re
+import bisect
+
+from utils.env_vars import *
+
+
+## Token-window chunking that snaps chunk boundaries back to the nearest paragraph or sentence break
+## within a tolerance window. The document is tokenized once; chunks are emitted as character spans
+## (start_char, end_char, token_count) of the original text, so no chunk is ever decoded from tokens.
+
+paragraph_break_re = re.compile(r'\n\s*\n')
+sentence_break_re = re.compile(r'[.!?;:](?=\s)')
+
+
+
+def get_token_offsets(enc, tokens):
+    ## character offset of the start of every token, plus the text length as a final sentinel
+    offsets = []
+    char_pos = 0
+
+    for token_bytes in enc.decode_tokens_bytes(tokens):
+        offsets.append(char_pos)
+        char_pos += sum([1 for b in token_bytes if (b & 0xC0) != 0x80])
+
+    offsets.append(char_pos)
+    return offsets
+
+
+
+def get_break_tokens(text, offsets, pattern):
+    ## token indices at which a break of the given pattern ends exactly on a token boundary
+    starts = {p: i for i, p in enumerate(offsets)}
+    return sorted(set([starts[m.end()] for m in pattern.finditer(text) if m.end() in starts]))
+
+
+
+class TokenChunker:
+
+    def __init__(self, text, enc, tokens = None, tolerance = CHUNK_SNAP_TOLERANCE):
+        self.text = text
+        self.tokens = enc.encode(text) if tokens is None else tokens
+        self.offsets = get_token_offsets(enc, self.tokens)
+        self.tolerance = tolerance
+        self.paragraph_breaks = get_break_tokens(text, self.offsets, paragraph_break_re)
+        self.sentence_breaks = get_break_tokens(text, self.offsets, sentence_break_re)
+
+
+    def snap(self, target, window):
+        ## latest paragraph break in (target - window, target], else latest sentence break, else target
+        n = len(self.tokens)
+        if (target >= n) or (window <= 0): return min(target, n)
+
+        for breaks in [self.paragraph_breaks, self.sentence_breaks]:
+            i = bisect.bisect_right(breaks, target) - 1
+            if (i >= 0) and (breaks[i] > target - window) and (breaks[i] > 0): return breaks[i]
+
+        return target
+
+
+    def get_spans(self, chunk_length, overlap = OVERLAP_TEXT):
+        n = len(self.tokens)
+        if n == 0: return []
+
+        window = int(chunk_length * self.tolerance)
+        spans = []
+        start = 0
+
+        while start < n:
+            core_end = self.snap(start + chunk_length, window)
+            if core_end <= start: core_end = min(start + chunk_length, n)
+
+            end = self.snap(core_end + overlap, window) if core_end < n else n
+            end = max(end, core_end)
+
+            spans.append((self.offsets[start], self.offsets[end], end - start))
+            start = core_end
+
+        return spans
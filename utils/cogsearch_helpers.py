@@ -1,6 +1,5 @@
 import logging
 import os
-import re
 
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
@@ -9,7 +8,10 @@ from azure.search.documents.models import QueryType
 from azure.search.documents.indexes.models import *
 
 from utils import openai_helpers
+from utils import lazy_init
 from utils.kb_doc import KB_Doc
+from utils.bulk_indexer import BulkIndexer
+from utils import text_cleaning
 from utils.cogvecsearch_helpers import cogsearch_vecstore
 
 from utils.env_vars import *
@@ -17,22 +19,28 @@ from utils.env_vars import *
 
 
 
-admin_client   = SearchIndexClient(endpoint=COG_SEARCH_ENDPOINT,
+def get_admin_client():
+    return lazy_init.get_resource('cogsearch_admin_client', lambda: SearchIndexClient(endpoint=COG_SEARCH_ENDPOINT,
                                    index_name=KB_INDEX_NAME,
-                                   credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY))
+                                   credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY)))
 
-search_client  = SearchClient(endpoint=COG_SEARCH_ENDPOINT,
+
+def get_search_client():
+    return lazy_init.get_resource('cogsearch_search_client', lambda: SearchClient(endpoint=COG_SEARCH_ENDPOINT,
                               index_name=KB_INDEX_NAME,
-                              credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY))
+                              credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY)))
+
 
-indexer_client = SearchIndexerClient(endpoint=COG_SEARCH_ENDPOINT,
+def get_indexer_client():
+    return lazy_init.get_resource('cogsearch_indexer_client', lambda: SearchIndexerClient(endpoint=COG_SEARCH_ENDPOINT,
                                      index_name=KB_INDEX_NAME,
-                                     credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY))
+                                     credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY)))
 
 
-sem_search_client = SearchClient(endpoint=COG_SEARCH_ENDPOINT,
+def get_sem_search_client():
+    return lazy_init.get_resource('cogsearch_sem_search_client', lambda: SearchClient(endpoint=COG_SEARCH_ENDPOINT,
                                     index_name=KB_SEM_INDEX_NAME,
-                                    credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY))
+                                    credential=AzureKeyCredential(COG_SEARCH_ADMIN_KEY)))
 
 
 include_category = None
@@ -59,7 +67,7 @@ def create_semantic_search_index():
     else:
 
         try:
-            result = admin_client.delete_index(KB_SEM_INDEX_NAME)
+            result = get_admin_client().delete_index(KB_SEM_INDEX_NAME)
             print ('Index', KB_SEM_INDEX_NAME, 'Deleted')
         except Exception as ex:
             print (f"Index deletion exception:\n{ex}")
@@ -84,7 +92,7 @@ def create_semantic_search_index():
         )
 
         try:
-            result = admin_client.create_index(index)
+            result = get_admin_client().create_index(index)
             print ('Index', result.name, 'created')
         except Exception as ex:
             print (f"Index creation exception:\n{ex}")        
@@ -94,7 +102,7 @@ def create_semantic_search_index():
 def create_index():
 
     try:
-        result = admin_client.delete_index(KB_INDEX_NAME)
+        result = get_admin_client().delete_index(KB_INDEX_NAME)
         print ('Index', KB_INDEX_NAME, 'Deleted')
     except Exception as ex:
         print (f"Index deletion exception:\n{ex}")
@@ -124,16 +132,24 @@ def create_index():
         cors_options=cors_options)
 
     try:
-        result = admin_client.create_index(index)
+        result = get_admin_client().create_index(index)
         print ('Index', result.name, 'created')
     except Exception as ex:
         print (f"Index creation exception:\n{ex}")
     
 
 
+def upload_semantic_batch(batch):
+    results = get_sem_search_client().upload_documents(documents=batch)
+    return [(r.key, r.succeeded, r.status_code) for r in results]
+
+
+semantic_indexer = BulkIndexer(upload_semantic_batch)
+
+
+
 def index_semantic_sections(sections):
 
-    i = 0
     batch = []
     for s in sections:
         dd = {
@@ -148,17 +164,22 @@ def index_semantic_sections(sections):
         }
 
         batch.append(dd) 
-        i += 1
-        if i % 1000 == 0:
-            results = sem_search_client.upload_documents(documents=batch)
-            succeeded = sum([1 for r in results if r.succeeded])
-            print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
-            batch = []
 
-    if len(batch) > 0:
-        results = sem_search_client.upload_documents(documents=batch)
-        succeeded = sum([1 for r in results if r.succeeded])
-        print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
+    return semantic_indexer.upload(batch)
+
+
+
+def get_semantic_sections(filename, container):
+    filename = filename.replace("'", "''")
+    r = get_sem_search_client().search("*", filter=f"filename eq '{filename}' and container eq '{container}'", select=["id", "content"])
+    return {doc['id']: doc['content'] for doc in r}
+
+
+
+def delete_semantic_sections(ids):
+    if len(ids) == 0: return 0
+    results = get_sem_search_client().delete_documents(documents=[{"id": i} for i in ids])
+    return sum([1 for r in results if r.succeeded])
 
 
 
@@ -183,13 +204,13 @@ def create_skillset():
                                         cognitive_services_account=CognitiveServicesAccountKey(key=COG_SERV_KEY))
 
     try:
-        indexer_client.delete_skillset(KB_SKILLSET_NAME)
+        get_indexer_client().delete_skillset(KB_SKILLSET_NAME)
         print(f"Deleted Skillset - {KB_SKILLSET_NAME}")
     except Exception as ex:
         print (f"Skillset deletion exception:\n{ex}")
 
     try:
-        result = indexer_client.create_skillset(skillset)
+        result = get_indexer_client().create_skillset(skillset)
         print(f"Created new Skillset - {KB_SKILLSET_NAME}")
     except Exception as ex:
         print (f"Skillset creation exception:\n{ex}")
@@ -220,25 +241,25 @@ def create_indexer(container):
         )
 
     try:
-        indexer_client.delete_indexer(indexer)
+        get_indexer_client().delete_indexer(indexer)
         print(f"Deleted Indexer - {KB_INDEXER_NAME}")
     except Exception as ex:
         print (f"Indexer deletion exception:\n{ex}")
 
     try:
-        indexer_client.delete_data_source_connection(data_source)
+        get_indexer_client().delete_data_source_connection(data_source)
         print(f"Deleted Data Source - {KB_SKILLSET_NAME}")
     except Exception as ex:
         print (f"Data Source deletion exception:\n{ex}")
 
     try:
-        result = indexer_client.create_data_source_connection(data_source)
+        result = get_indexer_client().create_data_source_connection(data_source)
         print(f"Created new Data Source Connection - {KB_DATA_SOURCE_NAME}")   
     except Exception as ex:
         print (f"Data source creation exception:\n{ex}")
 
     try:
-        result = indexer_client.create_indexer(indexer)
+        result = get_indexer_client().create_indexer(indexer)
         print(f"Created new Indexer - {KB_INDEXER_NAME}")
     except Exception as ex:
         print (f"Indexer creation exception:\n{ex}")
@@ -247,7 +268,7 @@ def create_indexer(container):
 
 def run_indexer():
     print (f"Running Indexer {KB_INDEXER_NAME}")
-    indexer_client.run_indexer(KB_INDEXER_NAME)
+    get_indexer_client().run_indexer(KB_INDEXER_NAME)
 
 
 
@@ -263,17 +284,6 @@ def ingest_kb(container = KB_BLOB_CONTAINER):
 
 
 
-re_strs = [
-    "customXml\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*", 
-    "ppt\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*",
-    "\.MsftOfcThm_[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*[\r\n\t\f\v ]\{[\r\n\t\f\v ].*[\r\n\t\f\v ]\}",
-    "SlidePowerPoint",
-    "PresentationPowerPoint",
-    '[a-zA-Z0-9]*\.(?:gif|emf)'
-    ]
-
-
-
 def process_filter(filter_param = None):
     proc_filter = None
     try:
@@ -304,7 +314,7 @@ def cog_search(terms: str, filter_param = None):
     
     # print(f"CogSearch filter: {filter}")
     
-    r = sem_search_client.search(terms, 
+    r = get_sem_search_client().search(terms, 
                                 filter=proc_filter,
                                 top = NUM_TOP_MATCHES,
                                 query_type=QueryType.SEMANTIC, 
@@ -325,10 +335,7 @@ def cog_search(terms: str, filter_param = None):
     if len(context) == 0:
         return ["Sorry, I couldn't find any information related to the question."]
 
-    for i in range(len(context)):
-        for re_str in re_strs:
-            matches = re.findall(re_str, context[i], re.DOTALL)
-            for m in matches: context[i] = context[i].replace(m, '')
+    context = [text_cleaning.clean_office_text(c) for c in context]
 
     final_context = []
     total_tokens = 0
@@ -359,7 +366,7 @@ def cog_lookup(terms: str, filter_param = None):
     # print(f"CogLookup terms: {terms} filter: {filter}")
     logging.info(f"CogLookup terms: {terms} filter: {filter}")
 
-    r = sem_search_client.search(terms, 
+    r = get_sem_search_client().search(terms, 
                                 filter=filter,
                                 top = 1,
                                 include_total_count=True,
@@ -377,7 +384,7 @@ def cog_lookup(terms: str, filter_param = None):
 
     if len(answers) > 0:
         context = answers[0].text
-        doc = sem_search_client.get_document(answers[0].key)
+        doc = get_sem_search_client().get_document(answers[0].key)
         if ('web_url' in doc.keys()) and (doc['web_url'] is not None) and (doc['web_url'] != ''):
             ref = f"[{doc['web_url']}] "
         else:
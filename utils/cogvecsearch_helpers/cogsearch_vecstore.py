@@ -9,14 +9,21 @@ from utils import helpers
 from utils import http_helpers
 import utils.cogvecsearch_helpers.cs_json
 from utils import openai_helpers
+from utils import embedding_cache
 
 from utils.env_vars import *
 from utils import kb_doc
 from utils import cv_helpers
 
+from utils.bulk_indexer import BulkIndexer
+
 import re
 
 
+## indexes known to exist in this process, so create_index runs once per index name
+created_indexes = set()
+
+
 class CogSearchVecStore:
 
     def __init__(self, api_key = COG_SEARCH_ADMIN_KEY, 
@@ -60,12 +67,28 @@ class CogSearchVecStore:
         return self.http_req.delete()
 
 
+    def ensure_index(self):
+        if self.index_name in created_indexes: return
+
+        try:
+            self.get_index()
+        except Exception:
+            self.create_index()
+
+        created_indexes.add(self.index_name)
+
+
+    def upload_batch(self, batch):
+        results = self.http_req.post(op ='index', body = {'value': batch})
+        return [(r['key'], r['status'], r['statusCode']) for r in results['value']]
+
+
     def upload_documents(self, documents):
 
-        docs_dict = copy.deepcopy(utils.cogvecsearch_helpers.cs_json.upload_docs_json)
+        docs = []
 
         for doc in documents:
-            doc_dict = copy.deepcopy(utils.cogvecsearch_helpers.cs_json.upload_doc_json)
+            doc_dict = dict(utils.cogvecsearch_helpers.cs_json.upload_doc_json)
                         
             for k in self.all_fields:
                 doc_dict[k] = doc.get(k, '')
@@ -75,11 +98,9 @@ class CogSearchVecStore:
             doc_dict['cv_image_vector'] = doc.get('cv_image_vector', [])
             doc_dict['cv_text_vector'] = doc.get('cv_text_vector', [])
             doc_dict["@search.action"] = "upload"
-            docs_dict['value'].append(doc_dict)
+            docs.append(doc_dict)
         
-        self.http_req.post(op ='index', body = docs_dict)
-
-        return docs_dict
+        return BulkIndexer(self.upload_batch).upload(docs)
 
 
 
@@ -97,6 +118,20 @@ class CogSearchVecStore:
 
 
 
+    def get_documents(self, filter, select = 'id, text_en', page_size = 1000):
+        ## the service returns at most 1000 documents per request, page with skip until exhausted
+        documents = []
+
+        while True:
+            query_dict = {'search': '*', 'filter': filter, 'select': select, 'top': page_size, 'skip': len(documents), 'orderby': 'id'}
+            page = self.http_req.post(op ='search', body = query_dict)['value']
+            documents += page
+            if len(page) < page_size: break
+
+        return documents
+
+
+
     def get_search_json(self, query, search_type = 'vector'):
         if search_type == 'vector':
             query_dict = copy.deepcopy(utils.cogvecsearch_helpers.cs_json.search_dict_vector)
@@ -115,7 +150,7 @@ class CogSearchVecStore:
             embedding_enc = openai_helpers.get_encoder(CHOSEN_EMB_MODEL)
             query_dict['vector']['fields'] = VECTOR_FIELD_IN_REDIS
             query = embedding_enc.decode(embedding_enc.encode(query)[:MAX_QUERY_TOKENS])
-            query_dict['vector']['value'] = openai_helpers.get_openai_embedding(query, CHOSEN_EMB_MODEL)    
+            query_dict['vector']['value'] = embedding_cache.get_query_embedding(query, CHOSEN_EMB_MODEL)    
         elif vector_name == 'cv_text_vector':
             cvr = cv_helpers.CV()
             query_dict['vector']['fields'] = vector_name
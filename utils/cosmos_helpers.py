@@ -4,89 +4,249 @@ import re
 import azure.functions as func
 import os
 from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos import exceptions
 import urllib
 import numpy as np
 import uuid
 import copy
+import time
+import threading
 from datetime import datetime, timedelta
+from multiprocessing.dummy import Pool as ThreadPool
 
 from utils import redis_helpers
+from utils import lazy_init
 from utils.env_vars import *
 
 
-try:
+partitionKeyPath = PartitionKey(path="/categoryId")
 
-    if DATABASE_MODE == 1:
-        client = CosmosClient(url=COSMOS_URI, credential=COSMOS_KEY)
-        partitionKeyPath = PartitionKey(path="/categoryId")
-        database = client.create_database_if_not_exists(id=COSMOS_DB_NAME)
 
-        def init_container():
 
-            indexing_policy={ "includedPaths":[{ "path":"/*"}], "excludedPaths":[{ "path":"/\"_etag\"/?"},{ "path":f"/{VECTOR_FIELD_IN_REDIS}/?"}]}
-            
-            try:
-                container = database.create_container_if_not_exists(id="documents", partition_key=partitionKeyPath,indexing_policy=indexing_policy)
-            except:
-                try:
-                    container = database.create_container_if_not_exists(id="documents", partition_key=partitionKeyPath,indexing_policy=indexing_policy)
+def init_container():
+    client = CosmosClient(url=COSMOS_URI, credential=COSMOS_KEY)
+    database = client.create_database_if_not_exists(id=COSMOS_DB_NAME)
 
-                except Exception as e:
-                    logging.error(f"Encountered error {e} while creating the container")
-                    print(f"Encountered error {e} while creating the container")
+    indexing_policy={ "includedPaths":[{ "path":"/*"}], "excludedPaths":[{ "path":"/\"_etag\"/?"},{ "path":f"/{VECTOR_FIELD_IN_REDIS}/?"}]}
+    
+    try:
+        container = database.create_container_if_not_exists(id="documents", partition_key=partitionKeyPath,indexing_policy=indexing_policy)
+    except:
+        try:
+            container = database.create_container_if_not_exists(id="documents", partition_key=partitionKeyPath,indexing_policy=indexing_policy)
 
-            return container
+        except Exception as e:
+            logging.error(f"Encountered error {e} while creating the container")
+            print(f"Encountered error {e} while creating the container")
+            raise
 
-        container = init_container()
-    
-except:
-    print("Failed to initialize Cosmos DB container")
-    logging.error("Failed to initialize Cosmos DB container")
+    return container
 
 
 
-def cosmos_restore_embeddings():
+def get_container():
+    ## created on first use, a failed initialization is retried on the next call
+    try:
+        return lazy_init.get_resource('cosmos_container', init_container)
+    except Exception as e:
+        print("Failed to initialize Cosmos DB container")
+        logging.error(f"Failed to initialize Cosmos DB container: {e}")
+        raise
+
+
+
+RESTORE_LOCK_KEY = 'restore:lock'
+RESTORE_STATUS_KEY = 'restore:status'
+RESTORE_LOADED_KEY = 'restore:loaded'
+RESTORE_STARTED_KEY = 'restore:started'
+RESTORE_COOLDOWN_KEY = 'restore:cooldown'
+
+release_lock_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
+
+
+
+def get_restore_progress(redis_conn = None):
+    if redis_conn is None: redis_conn = redis_helpers.get_new_conn()
+    if redis_conn is None: return {'status': 'idle', 'loaded': 0}
+
+    status, loaded, started = redis_conn.mget([RESTORE_STATUS_KEY, RESTORE_LOADED_KEY, RESTORE_STARTED_KEY])
+
+    return {
+        'status': status.decode('utf-8') if status is not None else 'idle',
+        'loaded': int(loaded or 0),
+        'started': float(started) if started is not None else None
+    }
+
+
+
+def cosmos_read_embedding_pages(feed_range = None):
     QUERY = "SELECT * FROM documents p WHERE p.categoryId = @categoryId"
     params = [dict(name="@categoryId", value=EMBCATEGORYID)]
 
-    embeddings = container.query_items(query=QUERY, parameters=params, enable_cross_partition_query=False)
+    if feed_range is None:
+        embeddings = get_container().query_items(query=QUERY, parameters=params, partition_key=EMBCATEGORYID, max_item_count=RESTORE_PAGE_SIZE)
+    else:
+        embeddings = get_container().query_items(query=QUERY, parameters=params, feed_range=feed_range, max_item_count=RESTORE_PAGE_SIZE)
+
+    for page in embeddings.by_page():
+        yield [{k: v for k, v in e.items() if not k.startswith('_')} for e in page]
+
+
+
+def cosmos_restore_feed_range(redis_conn, feed_range = None):
+    counter = 0
+
+    for page in cosmos_read_embedding_pages(feed_range):
+        loaded = redis_helpers.redis_bulk_upsert_embeddings(redis_conn, page, document_name = 'Cosmos restore')
+        counter += loaded
+
+        p = redis_conn.pipeline(transaction=False)
+        p.incrby(RESTORE_LOADED_KEY, loaded)
+        p.expire(RESTORE_LOCK_KEY, RESTORE_LOCK_TTL_SECS)
+        p.execute()
+
+    return counter
 
+
+
+def cosmos_restore_embeddings():
     redis_conn = redis_helpers.get_new_conn()
+    if redis_conn is None: return 0
+
+    lock_token = str(uuid.uuid4())
+    if not redis_conn.set(RESTORE_LOCK_KEY, lock_token, nx=True, ex=RESTORE_LOCK_TTL_SECS):
+        logging.info(f"Restore from Cosmos already running: {get_restore_progress(redis_conn)}")
+        return 0
+
+    p = redis_conn.pipeline(transaction=False)
+    p.set(RESTORE_STATUS_KEY, 'running')
+    p.set(RESTORE_LOADED_KEY, 0)
+    p.set(RESTORE_STARTED_KEY, time.time())
+    p.execute()
+
     counter = 0
-    
+
     try:
-        for e in embeddings:
-            counter += redis_helpers.redis_upsert_embedding(redis_conn, e)
-            
+        ## read feed ranges in parallel where the SDK exposes them, otherwise page through the single partition
+        feed_ranges = list(get_container().read_feed_ranges()) if hasattr(get_container(), 'read_feed_ranges') else [None]
+
+        pool = ThreadPool(max(1, min(len(feed_ranges), RESTORE_CONCURRENCY)))
+        counter = sum(pool.map(lambda fr: cosmos_restore_feed_range(redis_conn, fr), feed_ranges))
+        pool.close()
+        pool.join()
+
+        redis_conn.set(RESTORE_STATUS_KEY, 'done')
+
     except Exception as e:
-        print("No Documents found")
+        logging.error(f"Restore from Cosmos failed: {e}")
+        redis_conn.set(RESTORE_STATUS_KEY, 'failed')
+
+    finally:
+        redis_conn.set(RESTORE_COOLDOWN_KEY, 1, ex=RESTORE_COOLDOWN_SECS)
+        redis_conn.eval(release_lock_script, 1, RESTORE_LOCK_KEY, lock_token)
 
     logging.info(f"Loaded {counter} embeddings from Cosmos into Redis")
     print(f"Loaded {counter} embeddings from Cosmos into Redis")
 
+    return counter
+
+
+
+def start_background_restore(redis_conn = None):
+    if DATABASE_MODE != 1: return False
+
+    if redis_conn is None: redis_conn = redis_helpers.get_new_conn()
+    if redis_conn is None: return False
+
+    if redis_conn.exists(RESTORE_LOCK_KEY) or redis_conn.exists(RESTORE_COOLDOWN_KEY): return False
+
+    threading.Thread(target=cosmos_restore_embeddings, daemon=True).start()
+    return True
+
+
+
+def cosmos_upsert_with_retry(item, max_attempts = COSMOS_MAX_THROTTLE_RETRIES):
+    charge = {'ru': 0.0}
+
+    def record_charge(headers, result):
+        charge['ru'] += float(headers.get('x-ms-request-charge', 0))
+
+    for attempt in range(max_attempts):
+        try:
+            get_container().upsert_item(item, response_hook=record_charge)
+            return True, charge['ru']
+
+        except exceptions.CosmosHttpResponseError as e:
+            if (e.status_code != 429) or (attempt == max_attempts - 1):
+                logging.error(f"Failed backing up embedding {item.get('id', '')} to Cosmos: {e}")
+                return False, charge['ru']
+
+            headers = getattr(e, 'headers', None) or {}
+            time.sleep(int(headers.get('x-ms-retry-after-ms', 1000)) / 1000)
+
+        except Exception as e:
+            logging.error(f"Failed backing up embedding {item.get('id', '')} to Cosmos: {e}")
+            return False, charge['ru']
 
+    return False, charge['ru']
 
-def cosmos_backup_embeddings(emb_documents):
+
+
+def cosmos_backup_embeddings(emb_documents, concurrency = COSMOS_BACKUP_CONCURRENCY):
     
     ret_dict = {}
-    
-    try:
-        for e in emb_documents:
-            #e[VECTOR_FIELD_IN_REDIS] = np.array(e[VECTOR_FIELD_IN_REDIS]).astype(np.float32).tobytes()
-            e['categoryId'] = EMBCATEGORYID
-            container.upsert_item(e)
+    start = time.time()
 
-        ret_dict['status'] = f"Successfully loaded {len(emb_documents)} embedding documents into Cosmos"
+    items = [{**e, 'categoryId': EMBCATEGORYID} for e in emb_documents]
 
-    except Exception as e:
-        logging.error(e)
-        print(e)
-        ret_dict['status'] = f"Failed loading {len(emb_documents)} embeddings into Cosmos: {e}"
+    pool = ThreadPool(concurrency)
+    results = pool.map(cosmos_upsert_with_retry, items)
+    pool.close()
+    pool.join()
+
+    succeeded = sum([1 for ok, _ in results if ok])
+    ret_dict['ru'] = sum([ru for _, ru in results])
+    ret_dict['elapsed_secs'] = time.time() - start
+
+    if succeeded == len(emb_documents):
+        ret_dict['status'] = f"Successfully loaded {len(emb_documents)} embedding documents into Cosmos, consuming {ret_dict['ru']:.1f} RUs"
+    else:
+        ret_dict['status'] = f"Failed loading {len(emb_documents) - succeeded} of {len(emb_documents)} embeddings into Cosmos, consuming {ret_dict['ru']:.1f} RUs"
+        logging.error(ret_dict['status'])
 
+    logging.info(ret_dict['status'])
     return ret_dict
 
 
 
+def cosmos_get_doc_chunks(doc_id):
+    QUERY = "SELECT c.id, c.text_en FROM documents c WHERE c.categoryId = @categoryId AND STARTSWITH(c.id, @prefix)"
+    params = [dict(name="@categoryId", value=EMBCATEGORYID), dict(name="@prefix", value=f"{doc_id}_")]
+
+    items = get_container().query_items(query=QUERY, parameters=params, enable_cross_partition_query=False)
+    return {i['id']: i.get('text_en', '') for i in items}
+
+
+
+def cosmos_delete_embeddings(ids):
+    deleted = 0
+
+    for i in ids:
+        try:
+            get_container().delete_item(item=i, partition_key=EMBCATEGORYID)
+            deleted += 1
+        except Exception as e:
+            logging.error(f"Failed deleting embedding {i} from Cosmos: {e}")
+
+    return deleted
+
+
 
 def cosmos_store_contents(data_dict):
     ret_dict = {}
@@ -102,7 +262,7 @@ def cosmos_store_contents(data_dict):
         del new_doc['content']
 
     try:
-        container.upsert_item(new_doc)
+        get_container().upsert_item(new_doc)
         ret_dict['status'] = f"Document {new_doc['id']} was successfully inserted into Cosmos"
     except Exception as e:
         logging.error(e)
@@ -117,7 +277,7 @@ def cosmos_store_contents(data_dict):
 #     QUERY = "SELECT * FROM documents p WHERE p.categoryId = @categoryId"
 #     params = [dict(name="@categoryId", value=CATEGORYID)]
 
-#     contents = container.query_items(query=QUERY, parameters=params, enable_cross_partition_query=False, max_item_count=10)
+#     contents = get_container().query_items(query=QUERY, parameters=params, enable_cross_partition_query=False, max_item_count=10)
 #     counter = 0
     
 #     try:
@@ -0,0 +1,288 @@
+import hashlib
+import time
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from utils import redis_helpers
+from utils import openai_helpers
+
+from utils.env_vars import *
+
+
+## Chunk embedding cache in the Redis that also serves the vector index and chat history. An entry is the
+## float32 vector key plus its ':text' translation key, about 8 KB with ada-002, so the default bound of
+## EMB_CACHE_MAX_ENTRIES=20000 stays around 160 MB. The LRU set holds one member per entry and eviction
+## deletes both keys; both also carry EMB_CACHE_TTL_SECS, so a pair that escapes the LRU still expires.
+
+EMB_CACHE_PREFIX = 'embcache'
+
+
+
+def get_text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+
+class EmbeddingCache:
+
+    def __init__(self, embedding_model = CHOSEN_EMB_MODEL, redis_conn = None, max_entries = EMB_CACHE_MAX_ENTRIES, ttl = EMB_CACHE_TTL_SECS, enabled = True):
+
+        self.embedding_model = embedding_model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled and (USE_EMB_CACHE == 1) and (REDIS_ADDR is not None) and (REDIS_ADDR != '')
+        self.redis_conn = redis_conn
+
+        if self.enabled and (self.redis_conn is None):
+            self.redis_conn = redis_helpers.get_new_conn()
+
+        self.lru_key = f"{EMB_CACHE_PREFIX}:{self.embedding_model}:lru"
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+
+    def get_key(self, text_hash):
+        return f"{EMB_CACHE_PREFIX}:{self.embedding_model}:{text_hash}"
+
+
+    def get_text_key(self, text_hash):
+        return f"{EMB_CACHE_PREFIX}:{self.embedding_model}:{text_hash}:text"
+
+
+    def get_many(self, text_hashes):
+        if not self.enabled or (len(text_hashes) == 0): return {}
+
+        try:
+            ## raw float32 vector bytes and the utf-8 translation, nothing is unpickled from the shared Redis
+            keys = [self.get_key(h) for h in text_hashes] + [self.get_text_key(h) for h in text_hashes]
+            values = self.redis_conn.mget(keys)
+            vectors, texts = values[:len(text_hashes)], values[len(text_hashes):]
+        except Exception as e:
+            logging.warning(f"Embedding cache lookup failed: {e}")
+            return {}
+
+        found = {}
+        now = time.time()
+
+        for h, v, t in zip(text_hashes, vectors, texts):
+            if (v is None) or (t is None): continue
+            found[h] = {'embedding': np.frombuffer(v, dtype=np.float32).tolist(), 'translation': t.decode('utf-8')}
+
+        if len(found) > 0:
+            try:
+                self.redis_conn.zadd(self.lru_key, {self.get_key(h): now for h in found})
+            except Exception as e:
+                logging.warning(f"Embedding cache LRU update failed: {e}")
+
+        self.hits += len(found)
+        self.misses += len(text_hashes) - len(found)
+        self.record_stats(len(found), len(text_hashes) - len(found))
+
+        return found
+
+
+    def set_many(self, entries):
+        if not self.enabled or (len(entries) == 0): return 0
+
+        now = time.time()
+
+        try:
+            p = self.redis_conn.pipeline(transaction=False)
+            for h, e in entries.items():
+                p.set(self.get_key(h), np.asarray(e['embedding'], dtype=np.float32).tobytes(), ex=self.ttl)
+                p.set(self.get_text_key(h), e['translation'].encode('utf-8'), ex=self.ttl)
+            p.zadd(self.lru_key, {self.get_key(h): now for h in entries})
+            p.execute()
+            self.evict()
+        except Exception as e:
+            logging.warning(f"Embedding cache write failed: {e}")
+            return 0
+
+        return len(entries)
+
+
+    def evict(self):
+        overflow = self.redis_conn.zcard(self.lru_key) - self.max_entries
+        if overflow <= 0: return 0
+
+        ## LRU members are vector keys, the matching ':text' keys go with them
+        evicted = [k.decode('utf-8') if isinstance(k, bytes) else k for k, _ in self.redis_conn.zpopmin(self.lru_key, overflow)]
+        if len(evicted) > 0: self.redis_conn.delete(*(evicted + [f"{k}:text" for k in evicted]))
+
+        logging.info(f"Embedding cache evicted {len(evicted)} entries")
+        return len(evicted)
+
+
+    def record_stats(self, hits, misses):
+        try:
+            p = self.redis_conn.pipeline(transaction=False)
+            if hits > 0: p.incrby(f"{EMB_CACHE_PREFIX}:hits", hits)
+            if misses > 0: p.incrby(f"{EMB_CACHE_PREFIX}:misses", misses)
+            p.execute()
+        except Exception as e:
+            logging.warning(f"Embedding cache stats update failed: {e}")
+
+
+    def get_stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses, 'duplicates': self.duplicates}
+        lookups = self.hits + self.misses
+        stats['hit_rate'] = self.hits / lookups if lookups > 0 else 0.0
+
+        if self.enabled:
+            try:
+                total_hits, total_misses = self.redis_conn.mget([f"{EMB_CACHE_PREFIX}:hits", f"{EMB_CACHE_PREFIX}:misses"])
+                stats['total_hits'] = int(total_hits or 0)
+                stats['total_misses'] = int(total_misses or 0)
+                stats['entries'] = self.redis_conn.zcard(self.lru_key)
+            except Exception as e:
+                logging.warning(f"Embedding cache stats lookup failed: {e}")
+
+        return stats
+
+
+
+QUERY_EMB_CACHE_PREFIX = 'qembcache'
+
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+
+class QueryEmbeddingCache:
+
+    ## Level 1 is an in-process LRU, which also memoizes repeated embeddings of the same query within
+    ## one agent run. Level 2 is Redis, shared by all instances, with a TTL instead of a LRU index.
+
+    def __init__(self, max_entries = QUERY_EMB_CACHE_SIZE, ttl = QUERY_EMB_CACHE_TTL_SECS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.redis_enabled = (USE_EMB_CACHE == 1) and (REDIS_ADDR is not None) and (REDIS_ADDR != '')
+        self.redis_conn = None
+        self.stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+        self.unflushed = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+        self.last_flush = time.time()
+
+
+    def get_key(self, query, embedding_model):
+        return f"{QUERY_EMB_CACHE_PREFIX}:{embedding_model}:{get_text_hash(normalize_query(query))}"
+
+
+    def get_redis_conn(self):
+        if self.redis_conn is None: self.redis_conn = redis_helpers.get_new_conn()
+        return self.redis_conn
+
+
+    def set_local(self, key, embedding):
+        with self.lock:
+            self.local[key] = embedding
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_entries: self.local.popitem(last=False)
+
+
+    def get_redis(self, key):
+        if not self.redis_enabled: return None
+
+        try:
+            v = self.get_redis_conn().get(key)
+            return None if v is None else np.frombuffer(v, dtype=np.float32).tolist()
+        except Exception as e:
+            logging.warning(f"Query embedding cache lookup failed: {e}")
+            return None
+
+
+    def set_redis(self, key, embedding):
+        if not self.redis_enabled: return
+
+        try:
+            self.get_redis_conn().set(key, np.array(embedding).astype(np.float32).tobytes(), ex=self.ttl)
+        except Exception as e:
+            logging.warning(f"Query embedding cache write failed: {e}")
+
+
+    def record_stat(self, name):
+        ## counted locally, the shared Redis totals are only updated every few lookups or seconds
+        with self.lock:
+            self.stats[name] += 1
+            self.unflushed[name] += 1
+            due = (sum(self.unflushed.values()) >= QUERY_EMB_CACHE_STATS_FLUSH_EVERY) or (time.time() - self.last_flush >= QUERY_EMB_CACHE_STATS_FLUSH_SECS)
+
+        if due: self.flush_stats()
+
+
+    def flush_stats(self):
+        with self.lock:
+            counts = {n: c for n, c in self.unflushed.items() if c > 0}
+            self.unflushed = {n: 0 for n in self.unflushed}
+            self.last_flush = time.time()
+
+        if (not self.redis_enabled) or (len(counts) == 0): return
+
+        try:
+            pipe = self.get_redis_conn().pipeline(transaction=False)
+            for n, c in counts.items(): pipe.incrby(f"{QUERY_EMB_CACHE_PREFIX}:{n}", c)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Query embedding cache stats update failed: {e}")
+
+
+    def get_embedding(self, query, embedding_model = CHOSEN_EMB_MODEL):
+        key = self.get_key(query, embedding_model)
+
+        with self.lock:
+            if key in self.local:
+                self.local.move_to_end(key)
+                embedding = self.local[key]
+            else:
+                embedding = None
+
+        if embedding is not None:
+            self.record_stat('local_hits')
+            return embedding
+
+        embedding = self.get_redis(key)
+
+        if embedding is not None:
+            self.record_stat('redis_hits')
+        else:
+            self.record_stat('misses')
+            embedding = openai_helpers.get_openai_embedding(query, embedding_model)
+            self.set_redis(key, embedding)
+
+        self.set_local(key, embedding)
+        return embedding
+
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['local_entries'] = len(self.local)
+
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['redis_hits']) / lookups if lookups > 0 else 0.0
+
+        if self.redis_enabled:
+            self.flush_stats()
+            names = ['local_hits', 'redis_hits', 'misses']
+            try:
+                values = self.get_redis_conn().mget([f"{QUERY_EMB_CACHE_PREFIX}:{n}" for n in names])
+                for n, v in zip(names, values): stats[f"total_{n}"] = int(v or 0)
+            except Exception as e:
+                logging.warning(f"Query embedding cache stats lookup failed: {e}")
+
+        return stats
+
+
+
+query_cache = QueryEmbeddingCache()
+
+
+
+def get_query_embedding(query, embedding_model = CHOSEN_EMB_MODEL):
+    return query_cache.get_embedding(query, embedding_model)
@@ -18,19 +18,67 @@ SMALL_EMB_TOKEN_NUM = int(os.environ.get("SMALL_EMB_TOKEN_NUM", "750"))
 MEDIUM_EMB_TOKEN_NUM = int(os.environ.get("MEDIUM_EMB_TOKEN_NUM", "0"))
 LARGE_EMB_TOKEN_NUM = int(os.environ.get("LARGE_EMB_TOKEN_NUM", "0"))
 X_LARGE_EMB_TOKEN_NUM = int(os.environ.get("X_LARGE_EMB_TOKEN_NUM", "0"))
+CHUNK_SNAP_TOLERANCE = float(os.environ.get("CHUNK_SNAP_TOLERANCE", "0.1"))
+
+EMB_BATCH_MAX_INPUTS = int(os.environ.get("EMB_BATCH_MAX_INPUTS", "16"))
+EMB_BATCH_MAX_TOKENS = int(os.environ.get("EMB_BATCH_MAX_TOKENS", "32000"))
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "64"))
+
+INCREMENTAL_INDEXING = int(os.environ.get("INCREMENTAL_INDEXING", "1"))
+
+USE_ASYNC_INGESTION = int(os.environ.get("USE_ASYNC_INGESTION", "0"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_CHUNK_CONCURRENCY = int(os.environ.get("PIPELINE_CHUNK_CONCURRENCY", "2"))
+PIPELINE_EMBED_CONCURRENCY = int(os.environ.get("PIPELINE_EMBED_CONCURRENCY", "4"))
+PIPELINE_WRITE_CONCURRENCY = int(os.environ.get("PIPELINE_WRITE_CONCURRENCY", "2"))
 
 USE_BING = os.environ.get("USE_BING", "no")
 LIST_OF_COMMA_SEPARATED_URLS = os.environ.get("LIST_OF_COMMA_SEPARATED_URLS", "")
 
 USE_COG_VECSEARCH = int(os.environ.get("USE_COG_VECSEARCH", "0"))
 
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "redis")
+NUMPY_INDEX_PATH = os.environ.get("NUMPY_INDEX_PATH", "numpy_index")
+
 CONVERSATION_TTL_SECS = int(os.environ.get("CONVERSATION_TTL_SECS", "172800"))
 
+PROFILE_STARTUP = int(os.environ.get("PROFILE_STARTUP", "0"))
+
 DATABASE_MODE = int(os.environ.get("DATABASE_MODE", "0"))
+COSMOS_BACKUP_CONCURRENCY = int(os.environ.get("COSMOS_BACKUP_CONCURRENCY", "16"))
+COSMOS_MAX_THROTTLE_RETRIES = int(os.environ.get("COSMOS_MAX_THROTTLE_RETRIES", "10"))
+RESTORE_PAGE_SIZE = int(os.environ.get("RESTORE_PAGE_SIZE", "500"))
+RESTORE_CONCURRENCY = int(os.environ.get("RESTORE_CONCURRENCY", "4"))
+RESTORE_LOCK_TTL_SECS = int(os.environ.get("RESTORE_LOCK_TTL_SECS", "300"))
+RESTORE_COOLDOWN_SECS = int(os.environ.get("RESTORE_COOLDOWN_SECS", "300"))
 
 USE_REDIS_CACHE = int(os.environ.get("USE_REDIS_CACHE", "1"))
+REDIS_VECTOR_TYPE = os.environ.get("REDIS_VECTOR_TYPE", "FLOAT32")
+REDIS_PROJECTION_DIMS = int(os.environ.get("REDIS_PROJECTION_DIMS", "0"))
+REDIS_PROJECTION_SEED = int(os.environ.get("REDIS_PROJECTION_SEED", "42"))
+REDIS_BULK_BATCH_SIZE = int(os.environ.get("REDIS_BULK_BATCH_SIZE", "500"))
+USE_EMB_CACHE = int(os.environ.get("USE_EMB_CACHE", "1"))
+EMB_CACHE_MAX_ENTRIES = int(os.environ.get("EMB_CACHE_MAX_ENTRIES", "20000"))
+EMB_CACHE_TTL_SECS = int(os.environ.get("EMB_CACHE_TTL_SECS", "2592000"))
+QUERY_EMB_CACHE_SIZE = int(os.environ.get("QUERY_EMB_CACHE_SIZE", "1024"))
+QUERY_EMB_CACHE_TTL_SECS = int(os.environ.get("QUERY_EMB_CACHE_TTL_SECS", "604800"))
+QUERY_EMB_CACHE_STATS_FLUSH_EVERY = int(os.environ.get("QUERY_EMB_CACHE_STATS_FLUSH_EVERY", "100"))
+QUERY_EMB_CACHE_STATS_FLUSH_SECS = int(os.environ.get("QUERY_EMB_CACHE_STATS_FLUSH_SECS", "60"))
+
+USE_ANSWER_CACHE = int(os.environ.get("USE_ANSWER_CACHE", "0"))
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.985"))
+ANSWER_CACHE_TTL_SECS = int(os.environ.get("ANSWER_CACHE_TTL_SECS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+FANOUT_BACKEND_WORKERS = int(os.environ.get("FANOUT_BACKEND_WORKERS", "8"))
+FANOUT_BUDGET_SECS = float(os.environ.get("FANOUT_BUDGET_SECS", "10"))
+FANOUT_DEFAULT_TIMEOUT_SECS = float(os.environ.get("FANOUT_DEFAULT_TIMEOUT_SECS", "8"))
+FANOUT_BACKEND_TIMEOUTS = os.environ.get("FANOUT_BACKEND_TIMEOUTS", "redis_search:4,cog_lookup:6,cog_search:6,bing_lookup:8")
+FANOUT_HEDGE_AFTER_SECS = float(os.environ.get("FANOUT_HEDGE_AFTER_SECS", "0"))
+FANOUT_LATENCY_WINDOW = int(os.environ.get("FANOUT_LATENCY_WINDOW", "1000"))
 
 PROCESS_IMAGES = int(os.environ.get("PROCESS_IMAGES", "0"))
+SKILL_RECORD_CONCURRENCY = int(os.environ.get("SKILL_RECORD_CONCURRENCY", "8"))
 
 
 
@@ -58,6 +106,8 @@ SERVICEBUS_CONN_STR = os.environ.get("SERVICEBUS_CONN_STR", "")
 REDIS_ADDR = os.environ.get("REDIS_ADDR", "")
 REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD", "")
 REDIS_PORT = os.environ.get("REDIS_PORT", "10000")
+REDIS_POOL_MAX_CONNECTIONS = int(os.environ.get("REDIS_POOL_MAX_CONNECTIONS", "32"))
+REDIS_POOL_TIMEOUT_SECS = int(os.environ.get("REDIS_POOL_TIMEOUT_SECS", "20"))
 
 BING_SUBSCRIPTION_KEY = os.environ.get("BING_SUBSCRIPTION_KEY", "")
 BING_SEARCH_URL = os.environ.get("BING_SEARCH_URL", "https://api.bing.microsoft.com/v7.0/search")
@@ -68,6 +118,10 @@ TRANSLATION_LOCATION = os.environ.get("TRANSLATION_LOCATION", "westeurope")
 
 if TRANSLATION_API_KEY == "": TRANSLATION_API_KEY = COG_SERV_KEY
 
+TRANSLATION_BATCH_MAX_TEXTS = int(os.environ.get("TRANSLATION_BATCH_MAX_TEXTS", "100"))
+TRANSLATION_BATCH_MAX_CHARS = int(os.environ.get("TRANSLATION_BATCH_MAX_CHARS", "50000"))
+TRANSLATION_CACHE_TTL_SECS = int(os.environ.get("TRANSLATION_CACHE_TTL_SECS", "2592000"))
+
 
 ###################
 ## OpenAI Params ##
@@ -96,6 +150,10 @@ KB_FIELDS_FILENAME  = os.environ.get("KB_FIELDS_FILENAME", "filename")
 KB_SEM_INDEX_NAME = os.environ.get("KB_SEM_INDEX_NAME", "km-openai-sem")
 COG_VEC_SEARCH_API_VERSION = os.environ.get("COG_VEC_SEARCH_API_VERSION", "2023-07-01-Preview")
 COG_VECSEARCH_VECTOR_INDEX = os.environ.get("COG_VECSEARCH_VECTOR_INDEX", "vec-index")
+COG_SEARCH_BATCH_MAX_DOCS = int(os.environ.get("COG_SEARCH_BATCH_MAX_DOCS", "1000"))
+COG_SEARCH_BATCH_MAX_BYTES = int(os.environ.get("COG_SEARCH_BATCH_MAX_BYTES", "15000000"))
+COG_SEARCH_UPLOAD_CONCURRENCY = int(os.environ.get("COG_SEARCH_UPLOAD_CONCURRENCY", "4"))
+COG_SEARCH_UPLOAD_RETRIES = int(os.environ.get("COG_SEARCH_UPLOAD_RETRIES", "3"))
 
 
 
@@ -120,6 +178,10 @@ EMBCATEGORYID = os.environ.get("EMBCATEGORYID", "KM_OAI_EMB_CATEGORY")
 COSMOS_DB_NAME = os.environ.get("COSMOS_DB_NAME", "KM_OAI_DB")
 KB_BLOB_CONTAINER = os.environ.get("KB_BLOB_CONTAINER", "kmoaidemo")
 OUTPUT_BLOB_CONTAINER = os.environ.get("OUTPUT_BLOB_CONTAINER", "kmoaiprocessed")
+JSON_OUTPUT_FORMAT = os.environ.get("JSON_OUTPUT_FORMAT", "pretty") # pretty, compact or gzip
+SAS_EXPIRY_HOURS = int(os.environ.get("SAS_EXPIRY_HOURS", str(20*365*24)))
+SAS_REFRESH_MARGIN_SECS = int(os.environ.get("SAS_REFRESH_MARGIN_SECS", "3600"))
+SAS_CACHE_MAX_ENTRIES = int(os.environ.get("SAS_CACHE_MAX_ENTRIES", "10000"))
 CHOSEN_QUERY_EMB_MODEL = os.environ.get("CHOSEN_QUERY_EMB_MODEL", "text-embedding-ada-002")
 ADA_002_EMBED_NUM_DIMS = int(os.environ.get("ADA_002_EMBED_NUM_DIMS", "1536"))
 ADA_002_MODEL_MAX_TOKENS = int(os.environ.get("ADA_002_MODEL_MAX_TOKENS", "4095"))
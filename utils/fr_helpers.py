@@ -18,11 +18,13 @@ from tenacity import (
 
 
 from utils import storage
+from utils import lazy_init
 
 from utils.env_vars import *
 
 
-document_analysis_client = DocumentAnalysisClient(COG_SERV_ENDPOINT, AzureKeyCredential(COG_SERV_KEY))
+def get_document_analysis_client():
+    return lazy_init.get_resource('fr_document_analysis_client', lambda: DocumentAnalysisClient(COG_SERV_ENDPOINT, AzureKeyCredential(COG_SERV_KEY)))
 
 
 
@@ -49,7 +51,7 @@ def process_forms(in_container = FR_CONTAINER, out_container = OUTPUT_BLOB_CONTA
 
 def fr_analyze_doc(url):
 
-    poller = document_analysis_client.begin_analyze_document_from_url("prebuilt-document", url)
+    poller = get_document_analysis_client().begin_analyze_document_from_url("prebuilt-document", url)
     result = poller.result()
 
     contents = ''
@@ -89,7 +91,7 @@ def fr_analyze_doc(url):
 def fr_analyze_local_doc_with_dfs(path, verbose = True):
 
     with open(path, "rb") as f:
-        poller = document_analysis_client.begin_analyze_document("prebuilt-document", document=f)
+        poller = get_document_analysis_client().begin_analyze_document("prebuilt-document", document=f)
 
     result = poller.result()
     
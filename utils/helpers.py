@@ -1,6 +1,5 @@
 import os
 import pickle
-import re
 import numpy as np
 import tiktoken
 import json
@@ -19,19 +18,35 @@ from utils import redis_helpers
 from utils import openai_helpers
 from utils.kb_doc import KB_Doc
 from utils import cosmos_helpers
+from utils import embedding_cache
+from utils import numpy_vecstore
+from utils import chunking
+from utils import text_cleaning
 from utils.langchain_helpers import mod_agent
 
 from utils.env_vars import *
 
 
-def generate_embeddings(full_kbd_doc, embedding_model, max_emb_tokens, previous_max_tokens = 0, text_suffix = '',  gen_emb=True):
-    
-    emb_documents = []
+def get_embedding_tiers():
+    tiers = [(SMALL_EMB_TOKEN_NUM, 'S', 0), 
+             (MEDIUM_EMB_TOKEN_NUM, 'M', SMALL_EMB_TOKEN_NUM), 
+             (LARGE_EMB_TOKEN_NUM, 'L', MEDIUM_EMB_TOKEN_NUM), 
+             (X_LARGE_EMB_TOKEN_NUM, 'XL', LARGE_EMB_TOKEN_NUM)]
 
-    json_object = full_kbd_doc.get_dict()
+    return [t for t in tiers if t[0] != 0]
 
-    logging.info(f"Starting to generate embeddings with {embedding_model} and {max_emb_tokens} tokens")
-    print(f"Starting to generate embeddings with {embedding_model} and {max_emb_tokens} tokens")
+
+
+def detect_doc_languages(kbd_docs):
+    ## one Translator detect request per TRANSLATION_BATCH_MAX_TEXTS documents, on the start of their cleaned text
+    samples = [text_cleaning.clean_office_text((d.get_dict().get('text', '') or '')[:2000])[:500] for d in kbd_docs]
+    return language.detect_content_language_batch(samples)
+
+
+
+def prepare_embedding_doc(full_kbd_doc, embedding_model, lang = None):
+
+    json_object = full_kbd_doc.get_dict()
 
     try:
         if isinstance(json_object['timestamp'], list):
@@ -58,11 +73,10 @@ def generate_embeddings(full_kbd_doc, embedding_model, max_emb_tokens, previous_
     #### FOR DEMO PURPOSES ONLY -- OF COURSE NOT SECURE
 
 
-    doc_id = json_object['id']
-    doc_text = json_object['text']
+    doc_text = text_cleaning.clean_office_text(json_object['text'])
     enc = openai_helpers.get_encoder(embedding_model)
     tokens = enc.encode(doc_text)
-    lang = language.detect_content_language(doc_text[:500])
+    if lang is None: lang = language.detect_content_language(doc_text[:500])
     is_doc = json_object.get('doc_url', False) # doc_url empty for scraped webpages. web_url used instead.
     if is_doc:
         json_object['doc_url'] = storage.create_sas(json_object.get('doc_url', "https://microsoft.com"))
@@ -72,31 +86,92 @@ def generate_embeddings(full_kbd_doc, embedding_model, max_emb_tokens, previous_
     json_object['access'] = access
     json_object['orig_lang'] = lang
 
+    return {
+        'metadata': copy.deepcopy(json_object),
+        'doc_id': json_object['id'],
+        'filename': filename,
+        'lang': lang,
+        'enc': enc,
+        'tokens': tokens,
+        'chunker': chunking.TokenChunker(doc_text, enc, tokens)
+    }
+
+
+
+def build_tier_chunks(prepared_doc, max_emb_tokens, previous_max_tokens = 0, text_suffix = ''):
+
+    chunks = []
+    tokens = prepared_doc['tokens']
+    chunker = prepared_doc['chunker']
 
     print("Comparing lengths", len(tokens) , previous_max_tokens-OVERLAP_TEXT)
 
     if (len(tokens) < previous_max_tokens-OVERLAP_TEXT) and (previous_max_tokens > 0):
         print("Skipping generating embeddings as it is optional for this text")
-        return emb_documents
+        return chunks
+
+    for suff, (start_char, end_char, token_count) in enumerate(chunker.get_spans(chunk_length=max_emb_tokens-OVERLAP_TEXT)):
+        chunks.append({
+            'id': f"{prepared_doc['doc_id']}_{text_suffix}_{suff}",
+            'text': chunker.text[start_char:end_char],
+            'start_char': start_char,
+            'end_char': end_char,
+            'token_count': token_count
+        })
+
+    return chunks
+
 
 
+def embed_chunks(prepared_doc, chunks, embedding_model, gen_emb = True):
+
+    emb_documents = []
+    lang = prepared_doc['lang']
+    filename = prepared_doc['filename']
+
+    cache = embedding_cache.EmbeddingCache(embedding_model, enabled = gen_emb)
+
+    unique_chunks = {}
+    for c in chunks:
+        c['hash'] = embedding_cache.get_text_hash(c['text'])
+        if c['hash'] not in unique_chunks: unique_chunks[c['hash']] = c
+
+    cache.duplicates += len(chunks) - len(unique_chunks)
+    results = cache.get_many(list(unique_chunks.keys()))
+    to_process = [c for h, c in unique_chunks.items() if h not in results]
+
+    translated_chunks = [c['text'] for c in to_process]
+    translated = [True] * len(to_process)
+
+    if lang != 'en': 
+        ## a failed translation falls back to the source text for this run only
+        translations = language.translate_batch(translated_chunks, lang)
+        translated = [t is not None for t in translations]
+        translated_chunks = [t if t is not None else c['text'] for t, c in zip(translations, to_process)]
+        if not all(translated): logging.warning(f"{translated.count(False)} chunks of document {filename} could not be translated")
+
+    if gen_emb:
+        token_counts = [c['token_count'] for c in to_process] if lang == 'en' else None
+        embeddings = openai_helpers.get_openai_embeddings(translated_chunks, embedding_model, token_counts = token_counts)
+    else:
+        embeddings = [''] * len(translated_chunks)
+
+    new_entries = {c['hash']: {'embedding': e, 'translation': t} for c, t, e in zip(to_process, translated_chunks, embeddings)}
+    results.update(new_entries)
+
+    ## only embeddings of successfully translated text are cached, fallbacks are retried next time
+    cache.set_many({c['hash']: new_entries[c['hash']] for c, ok in zip(to_process, translated) if ok})
+    logging.info(f"Embedding cache stats for document {filename}: {cache.get_stats()}")
+
     suff = 0 
-    for chunk in chunked_words(tokens, chunk_length=max_emb_tokens-OVERLAP_TEXT):
-        decoded_chunk = enc.decode(chunk)
-        
-        translated_chunk = decoded_chunk
-        if lang != 'en': 
-            translated_chunk = language.translate(decoded_chunk, lang)
-       
-        if gen_emb:
-            embedding = openai_helpers.get_openai_embedding(translated_chunk, embedding_model)
-        else:
-            embedding = ''
+    for c in chunks:
+        translated_chunk = results[c['hash']]['translation']
+        embedding = results[c['hash']]['embedding']
 
-        dd = copy.deepcopy(json_object)
-        dd['id'] = f"{doc_id}_{text_suffix}_{suff}"
+        dd = copy.deepcopy(prepared_doc['metadata'])
+        dd['id'] = c['id']
         dd['text_en'] = translated_chunk
-        if lang != 'en': dd['text'] = decoded_chunk
+        if lang != 'en': dd['text'] = c['text']
         else: dd['text'] = ''
         dd[VECTOR_FIELD_IN_REDIS] = embedding
 
@@ -118,23 +193,77 @@ def generate_embeddings(full_kbd_doc, embedding_model, max_emb_tokens, previous_
 
 
 
+def generate_embeddings(full_kbd_doc, embedding_model, max_emb_tokens, previous_max_tokens = 0, text_suffix = '',  gen_emb=True, lang = None):
+    
+    logging.info(f"Starting to generate embeddings with {embedding_model} and {max_emb_tokens} tokens")
+    print(f"Starting to generate embeddings with {embedding_model} and {max_emb_tokens} tokens")
+
+    prepared_doc = prepare_embedding_doc(full_kbd_doc, embedding_model, lang)
+    chunks = build_tier_chunks(prepared_doc, max_emb_tokens, previous_max_tokens, text_suffix)
+
+    return embed_chunks(prepared_doc, chunks, embedding_model, gen_emb)
+
+
+
+def generate_tiered_embeddings_stream(full_kbd_doc, embedding_model, tiers = None, batch_size = STREAM_BATCH_SIZE, lang = None, stats = None):
+
+    if tiers is None: tiers = get_embedding_tiers()
+
+    logging.info(f"Starting to stream embeddings with {embedding_model} for tiers {tiers}")
+    print(f"Starting to stream embeddings with {embedding_model} for tiers {tiers}")
+
+    prepared_doc = prepare_embedding_doc(full_kbd_doc, embedding_model, lang)
+
+    chunks = []
+    for max_emb_tokens, text_suffix, previous_max_tokens in tiers:
+        chunks += build_tier_chunks(prepared_doc, max_emb_tokens, previous_max_tokens, text_suffix)
+
+    if stats is not None: stats['tokens'] = len(prepared_doc['tokens'])
+
+    for i in range(0, len(chunks), batch_size):
+        yield from embed_chunks(prepared_doc, chunks[i:i+batch_size], embedding_model)
+
+
+
+def micro_batches(iterable, batch_size = STREAM_BATCH_SIZE):
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+
 def generate_embeddings_from_json_docs(json_folder, embedding_model, max_emb_tokens, text_suffix='M', limit = -1):
     
     emb_documents = []
 
-    counter = 0
-    for item in os.listdir(json_folder):
-        if (limit != -1 ) and (counter >= limit): break
-        path = os.path.join(json_folder, item)
+    items = os.listdir(json_folder)
+    if limit != -1: items = items[:limit]
 
-        with open(path, 'r') as openfile:
-            json_object = json.load(openfile)
-        
-        doc_embs = generate_embeddings(json_object, embedding_model, max_emb_tokens = max_emb_tokens, text_suffix = text_suffix)
-        emb_documents += doc_embs
-        counter += 1
+    for i in range(0, len(items), TRANSLATION_BATCH_MAX_TEXTS):
+        paths = [os.path.join(json_folder, item) for item in items[i:i+TRANSLATION_BATCH_MAX_TEXTS]]
+        json_objects = []
 
-        print(f"Now processing {path}, generated {len(doc_embs)} chunks")
+        for path in paths:
+            with open(path, 'r') as openfile:
+                json_objects.append(json.load(openfile))
+
+        langs = language.detect_content_language_batch([j['text'][:500] for j in json_objects])
+
+        for path, json_object, lang in zip(paths, json_objects, langs):
+            kbd_doc = KB_Doc()
+            kbd_doc.load(json_object)
+
+            doc_embs = generate_embeddings(kbd_doc, embedding_model, max_emb_tokens = max_emb_tokens, text_suffix = text_suffix, lang = lang)
+            emb_documents += doc_embs
+
+            print(f"Now processing {path}, generated {len(doc_embs)} chunks")
 
     return emb_documents
 
@@ -162,18 +291,9 @@ def load_embedding_docs_in_redis(emb_documents, emb_filename = '', document_name
     print(f"Loading {len(emb_documents)} embeddings into Redis")
     logging.info(f"Loading {len(emb_documents)} embeddings into Redis")
 
-    counter = 0
-    loaded = 0
-
-    for e in emb_documents:
-        loaded += redis_helpers.redis_upsert_embedding(redis_conn, e)
-
-        counter +=1
-        if counter % 200 == 0:
-            print (f'Processed: {counter} of {len(emb_documents)} for document {document_name}')
-            logging.info (f'Processed: {counter} of {len(emb_documents)} for document {document_name}')
+    loaded = redis_helpers.redis_bulk_upsert_embeddings(redis_conn, emb_documents, document_name = document_name)
     
-    print (f'Processed: {counter} of {len(emb_documents)} for document {document_name}')
+    print (f'Processed: {loaded} of {len(emb_documents)} for document {document_name}')
 
     return loaded
 
@@ -200,35 +320,33 @@ def push_summarizations(doc_text, completion_model, max_output_tokens):
 
 
 
-re_strs = [
-    "customXml\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*", 
-    "ppt\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*",
-    "\.MsftOfcThm_[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*[\r\n\t\f\v ]\{[\r\n\t\f\v ].*[\r\n\t\f\v ]\}",
-    "SlidePowerPoint",
-    "PresentationPowerPoint",
-    '[a-zA-Z0-9]*\.(?:gif|emf)'
-    ]
+def query_vector_index(query_embedding, topK, filter_param):
+    if VECTOR_BACKEND == 'numpy':
+        return numpy_vecstore.get_store().search(query_embedding, topK=topK, filter_param=filter_param)
+
+    redis_conn = redis_helpers.get_new_conn()
+    results = redis_helpers.redis_query_embedding_index(redis_conn, query_embedding, -1, topK=topK, filter_param=filter_param)
+
+    ## an empty result is usually just a query (or filter) that matches nothing, restore only into an empty index
+    if (len(results) == 0) and (redis_helpers.get_index_doc_count(redis_conn) == 0):
+        logging.warning("No embeddings found in Redis, attempting to load embeddings from Cosmos in the background")
+        cosmos_helpers.start_background_restore(redis_conn)
+
+    return results
 
 
 
 def redis_search(query: str, filter_param: str):
-    if (REDIS_ADDR is None) or (REDIS_ADDR == ''): 
+    if (VECTOR_BACKEND != 'numpy') and ((REDIS_ADDR is None) or (REDIS_ADDR == '')): 
         return ["Sorry, I couldn't find any information related to the question."]
 
 
-    redis_conn = redis_helpers.get_new_conn()
-    completion_enc = openai_helpers.get_encoder(CHOSEN_COMP_MODEL)
     embedding_enc = openai_helpers.get_encoder(CHOSEN_EMB_MODEL)
 
     query = embedding_enc.decode(embedding_enc.encode(query)[:MAX_QUERY_TOKENS])
 
-    query_embedding = openai_helpers.get_openai_embedding(query, CHOSEN_EMB_MODEL)    
-    results = redis_helpers.redis_query_embedding_index(redis_conn, query_embedding, -1, topK=NUM_TOP_MATCHES, filter_param=filter_param)
-
-    if len(results) == 0:
-        logging.warning("No embeddings found in Redis, attempting to load embeddings from Cosmos")
-        cosmos_helpers.cosmos_restore_embeddings()
-        results = redis_helpers.redis_query_embedding_index(redis_conn, query_embedding, -1, topK=NUM_TOP_MATCHES, filter_param=filter_param)
+    query_embedding = embedding_cache.get_query_embedding(query, CHOSEN_EMB_MODEL)    
+    results = query_vector_index(query_embedding, NUM_TOP_MATCHES, filter_param)
     
     return process_search_results(results)
     
@@ -254,10 +372,7 @@ def process_search_results(results):
             context.append('######\n' + t['text_en'] + '\n######\n')
 
 
-    for i in range(len(context)):
-        for re_str in re_strs:
-            matches = re.findall(re_str, context[i], re.DOTALL)
-            for m in matches: context[i] = context[i].replace(m, '')
+    context = [text_cleaning.clean_office_text(c) for c in context]
 
     final_context = []
     total_tokens = 0
@@ -274,25 +389,17 @@ def process_search_results(results):
 
 
 def redis_lookup(query: str, filter_param: str):
-    redis_conn = redis_helpers.get_new_conn()
     completion_enc = openai_helpers.get_encoder(CHOSEN_COMP_MODEL)
 
     embedding_enc = openai_helpers.get_encoder(CHOSEN_EMB_MODEL)
     query = embedding_enc.decode(embedding_enc.encode(query)[:MAX_QUERY_TOKENS])
 
-    query_embedding = openai_helpers.get_openai_embedding(query, CHOSEN_EMB_MODEL)    
-    results = redis_helpers.redis_query_embedding_index(redis_conn, query_embedding, -1, topK=1, filter_param=filter_param)
-
-    if len(results) == 0:
-        logging.warning("No embeddings found in Redis, attempting to load embeddings from Cosmos")
-        cosmos_helpers.cosmos_restore_embeddings()
-        results = redis_helpers.redis_query_embedding_index(redis_conn, query_embedding, -1, topK=NUM_TOP_MATCHES, filter_param=filter_param)
+    query_embedding = embedding_cache.get_query_embedding(query, CHOSEN_EMB_MODEL)    
+    results = query_vector_index(query_embedding, 1, filter_param)
         
     context = ' \n'.join([f"[{t['container']}/{t['filename']}] " + t['text_en'].replace('\n', ' ') for t in results])
     
-    for re_str in re_strs:
-        matches = re.findall(re_str, context, re.DOTALL)
-        for m in matches: context = context.replace(m, '')
+    context = text_cleaning.clean_office_text(context)
 
     context = completion_enc.decode(completion_enc.encode(context)[:MAX_SEARCH_TOKENS])
     return context
@@ -0,0 +1,119 @@
+import logging
+import re
+import threading
+
+from utils import redis_helpers
+from utils import cosmos_helpers
+from utils import cogsearch_helpers
+from utils import embedding_cache
+from utils import numpy_vecstore
+from utils import ingestion_pipeline
+from utils.cogvecsearch_helpers import cogsearch_vecstore
+
+from utils.env_vars import *
+
+
+
+def get_fingerprint(text):
+    return embedding_cache.get_text_hash(text if text is not None else '')
+
+
+
+def get_indexed_chunks(doc_id, filename, container):
+    id_regex = rf"^{re.escape(doc_id)}_[A-Z]+_\d+$"
+    backends = {}
+
+    if VECTOR_BACKEND == 'numpy':
+        backends['numpy'] = numpy_vecstore.get_store().get_doc_chunks(doc_id)
+    elif (REDIS_ADDR is not None) and (REDIS_ADDR != ''):
+        backends['redis'] = redis_helpers.redis_get_doc_chunks(redis_helpers.get_new_conn(), doc_id)
+
+    if USE_COG_VECSEARCH == 1:
+        vs = cogsearch_vecstore.CogSearchVecStore()
+        escaped_filename = filename.replace("'", "''")
+        filter = f"filename eq '{escaped_filename}' and container eq '{container}'"
+        backends['cogsearch'] = {d['id']: d.get('text_en', '') for d in vs.get_documents(filter)}
+    else:
+        backends['cogsearch'] = cogsearch_helpers.get_semantic_sections(filename, container)
+
+    if DATABASE_MODE == 1:
+        backends['cosmos'] = cosmos_helpers.cosmos_get_doc_chunks(doc_id)
+
+    return {name: {i: get_fingerprint(t) for i, t in chunks.items() if re.match(id_regex, i)} for name, chunks in backends.items()}
+
+
+
+def filter_changed_chunks(emb_stream, indexed, seen_ids, stats):
+    for e in emb_stream:
+        seen_ids.add(e['id'])
+        fingerprint = get_fingerprint(e['text_en'])
+
+        if (len(indexed) > 0) and all([chunks.get(e['id'], None) == fingerprint for chunks in indexed.values()]):
+            stats['unchanged'] += 1
+            continue
+
+        yield e
+
+
+
+def delete_chunks(ids):
+    stats = {'deleted': len(ids)}
+    if len(ids) == 0: return stats
+
+    if VECTOR_BACKEND == 'numpy':
+        numpy_vecstore.get_store().delete_documents(ids)
+    elif (REDIS_ADDR is not None) and (REDIS_ADDR != ''):
+        redis_helpers.redis_delete_keys(redis_helpers.get_new_conn(), ids)
+
+    if USE_COG_VECSEARCH == 1:
+        cogsearch_vecstore.CogSearchVecStore().delete_documents(ids = ids)
+    else:
+        cogsearch_helpers.delete_semantic_sections(ids)
+
+    if DATABASE_MODE == 1:
+        cosmos_helpers.cosmos_delete_embeddings(ids)
+
+    return stats
+
+
+
+def update_document_index(emb_stream, doc_id, filename, container, sinks = None, document_name = ''):
+
+    indexed = get_indexed_chunks(doc_id, filename, container)
+
+    seen_ids = set()
+    filter_stats = {'unchanged': 0}
+
+    changed_stream = filter_changed_chunks(emb_stream, indexed, seen_ids, filter_stats)
+    stats = ingestion_pipeline.write_stream_to_sinks(changed_stream, sinks, document_name = document_name)
+    stats.update(filter_stats)
+
+    orphans = list(set().union(*[set(chunks.keys()) for chunks in indexed.values()]) - seen_ids)
+    stats.update(delete_chunks(orphans))
+
+    logging.info(f"Incremental update of document {document_name}: {stats}")
+    return stats
+
+
+
+def update_document_index_async(kbd_doc, doc_id, filename, container, embedding_model = CHOSEN_EMB_MODEL, sinks = None, document_name = ''):
+    ## same incremental update, with the chunks embedded and written by the async ingestion pipeline
+    indexed = get_indexed_chunks(doc_id, filename, container)
+
+    seen_ids = set()
+    filter_stats = {'unchanged': 0}
+    filter_lock = threading.Lock()
+
+    def chunk_filter(emb_documents):
+        with filter_lock:
+            return list(filter_changed_chunks(emb_documents, indexed, seen_ids, filter_stats))
+
+    stats = ingestion_pipeline.ingest_documents([kbd_doc], embedding_model, sinks = sinks, chunk_filter = chunk_filter)
+    stats.update(filter_stats)
+
+    ## ingest_documents raises on any failed batch, so every live chunk id has been seen here
+    orphans = list(set().union(*[set(chunks.keys()) for chunks in indexed.values()]) - seen_ids)
+    stats.update(delete_chunks(orphans))
+
+    logging.info(f"Incremental update of document {document_name}: {stats}")
+    return stats
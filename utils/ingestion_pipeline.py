@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import threading
+import time
+
+from utils import helpers
+from utils import cosmos_helpers
+from utils import cogsearch_helpers
+from utils import numpy_vecstore
+from utils.kb_doc import KB_Doc
+from utils.cogvecsearch_helpers import cogsearch_vecstore
+
+from utils.env_vars import *
+
+
+## Stages: document -> chunks -> (cache, translate, embed) -> sinks
+## Each stage runs its own workers and hands work to the next stage through a bounded queue,
+## so translation, embedding and index writes of different chunk batches overlap.
+
+STOP = object()
+
+
+
+def get_default_sinks():
+    sinks = []
+
+    if VECTOR_BACKEND == 'numpy':
+        sinks.append(('numpy', numpy_vecstore.get_store().upsert_documents))
+    elif (REDIS_ADDR is not None) and (REDIS_ADDR != ''):
+        sinks.append(('redis', helpers.load_embedding_docs_in_redis))
+
+    if USE_COG_VECSEARCH == 1:
+        sinks.append(('cogvecsearch', cogsearch_vecstore.CogSearchVecStore().upload_documents))
+    else:
+        sinks.append(('cogsearch', cogsearch_helpers.index_semantic_sections))
+
+    if DATABASE_MODE == 1:
+        sinks.append(('cosmos', cosmos_helpers.cosmos_backup_embeddings))
+
+    return sinks
+
+
+
+def flush_sinks():
+    ## the numpy index buffers upserts, persist the whole document in one save
+    if VECTOR_BACKEND == 'numpy': numpy_vecstore.get_store().flush()
+
+
+
+def write_stream_to_sinks(emb_stream, sinks = None, batch_size = STREAM_BATCH_SIZE, document_name = ''):
+    if sinks is None: sinks = get_default_sinks()
+
+    stats = {'chunks': 0}
+    for sink_name, _ in sinks: stats[sink_name] = 0
+
+    for batch in helpers.micro_batches(emb_stream, batch_size):
+        for sink_name, sink in sinks:
+            loaded = sink(batch)
+            stats[sink_name] += loaded if isinstance(loaded, int) else len(batch)
+
+        stats['chunks'] += len(batch)
+        logging.info(f"Streamed {stats['chunks']} emb chunks into sinks for document {document_name}")
+
+    flush_sinks()
+    return stats
+
+
+
+async def run_stage(name, func, in_queue, out_queue, concurrency, next_concurrency, stats):
+
+    async def worker():
+        while True:
+            item = await in_queue.get()
+            if item is STOP: break
+
+            try:
+                results = await asyncio.to_thread(func, item)
+            except Exception as e:
+                logging.error(f"Ingestion pipeline stage {name} failed: {e}")
+                stats['errors'] += 1
+                continue
+
+            if out_queue is not None:
+                for r in results: await out_queue.put(r)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    if out_queue is not None:
+        for _ in range(next_concurrency): await out_queue.put(STOP)
+
+
+
+async def ingest_documents_async(kbd_docs, embedding_model = CHOSEN_EMB_MODEL, tiers = None, sinks = None, chunk_filter = None,
+                                 chunk_concurrency = PIPELINE_CHUNK_CONCURRENCY,
+                                 embed_concurrency = PIPELINE_EMBED_CONCURRENCY,
+                                 write_concurrency = PIPELINE_WRITE_CONCURRENCY,
+                                 queue_size = PIPELINE_QUEUE_SIZE):
+
+    if tiers is None: tiers = helpers.get_embedding_tiers()
+    if sinks is None: sinks = get_default_sinks()
+
+    stats = {'docs': 0, 'chunks': 0, 'errors': 0}
+    for sink_name, _ in sinks: stats[sink_name] = 0
+    stats_lock = threading.Lock()
+
+    def add_stat(key, value):
+        with stats_lock: stats[key] += value
+
+    doc_queue = asyncio.Queue(maxsize=queue_size)
+    chunk_queue = asyncio.Queue(maxsize=queue_size)
+    emb_queue = asyncio.Queue(maxsize=queue_size)
+
+
+    def to_kb_doc(kbd_doc):
+        if isinstance(kbd_doc, KB_Doc): return kbd_doc
+        d = KB_Doc()
+        d.load(kbd_doc)
+        return d
+
+
+    def chunk_doc(item):
+        kbd_doc, lang = item
+        prepared_doc = helpers.prepare_embedding_doc(kbd_doc, embedding_model, lang)
+
+        chunks = []
+        for max_emb_tokens, text_suffix, previous_max_tokens in tiers:
+            chunks += helpers.build_tier_chunks(prepared_doc, max_emb_tokens, previous_max_tokens, text_suffix)
+
+        add_stat('docs', 1)
+        return [(prepared_doc, chunks[i:i+EMB_BATCH_MAX_INPUTS]) for i in range(0, len(chunks), EMB_BATCH_MAX_INPUTS)]
+
+
+    def embed_batch(item):
+        prepared_doc, chunks = item
+        emb_documents = helpers.embed_chunks(prepared_doc, chunks, embedding_model)
+        add_stat('chunks', len(emb_documents))
+        return [emb_documents]
+
+
+    def write_batch(emb_documents):
+        if chunk_filter is not None: emb_documents = chunk_filter(emb_documents)
+        if len(emb_documents) == 0: return []
+
+        for sink_name, sink in sinks:
+            loaded = sink(emb_documents)
+            add_stat(sink_name, loaded if isinstance(loaded, int) else len(emb_documents))
+        return []
+
+
+    async def feed():
+        ## languages are detected in Translator batches before the documents enter the chunk stage
+        docs = [to_kb_doc(d) for d in kbd_docs]
+
+        for i in range(0, len(docs), TRANSLATION_BATCH_MAX_TEXTS):
+            batch = docs[i:i+TRANSLATION_BATCH_MAX_TEXTS]
+            langs = await asyncio.to_thread(helpers.detect_doc_languages, batch)
+            for item in zip(batch, langs): await doc_queue.put(item)
+
+        for _ in range(chunk_concurrency): await doc_queue.put(STOP)
+
+
+    start = time.time()
+
+    await asyncio.gather(
+        feed(),
+        run_stage('chunk', chunk_doc, doc_queue, chunk_queue, chunk_concurrency, embed_concurrency, stats),
+        run_stage('embed', embed_batch, chunk_queue, emb_queue, embed_concurrency, write_concurrency, stats),
+        run_stage('write', write_batch, emb_queue, None, write_concurrency, 0, stats)
+    )
+
+    flush_sinks()
+
+    stats['elapsed_secs'] = time.time() - start
+    logging.info(f"Ingestion pipeline finished: {stats}")
+    print(f"Ingestion pipeline finished: {stats}")
+
+    ## failed batches are not written anywhere, fail the message so that it is retried or dead-lettered
+    if stats['errors'] > 0:
+        raise Exception(f"Ingestion pipeline had {stats['errors']} failed work items: {stats}")
+
+    return stats
+
+
+
+def ingest_documents(kbd_docs, embedding_model = CHOSEN_EMB_MODEL, tiers = None, sinks = None, chunk_filter = None):
+    return asyncio.run(ingest_documents_async(kbd_docs, embedding_model, tiers, sinks, chunk_filter))
@@ -9,6 +9,7 @@ import copy
 import uuid
 import urllib
 import sys
+import threading
 
 
 from langchain.llms.openai import AzureOpenAI
@@ -38,10 +39,13 @@ from utils import redis_helpers
 from utils import helpers
 from utils import storage
 from utils import cv_helpers
+from utils import text_cleaning
+from utils import embedding_cache
+from utils import answer_cache
+from utils import search_fanout
 
 from utils.helpers import redis_search, redis_lookup
 from utils.cogsearch_helpers import cog_search, cog_lookup, cog_vecsearch
-from multiprocessing.dummy import Pool as ThreadPool
 from utils.cogvecsearch_helpers import cogsearch_vecstore
 
 
@@ -66,17 +70,49 @@ openai.api_base = OPENAI_RESOURCE_ENDPOINT
 
 
 DEFAULT_RESPONSE = "Sorry, the question was not clear, or the information is not in the knowledge base. Please rephrase your question."
+TECHNICAL_ERROR_RESPONSE = 'I am sorry, I am not able to find an answer to your question. Please try again with a different question.'
 
 
 
-pool = ThreadPool(6)
+## request-independent agents, keyed by (agent_name, enabled tools, model); see get_agent_template
+agent_templates = {}
+agent_templates_lock = threading.Lock()
+
+
+
+
+def get_agent_template_key(agent_name, params_dict, force_redis = True):
+    flags = ['enable_unified_search', 'enable_cognitive_search', 'enable_redis_search', 'use_calendar', 'use_calculator', 'use_bing']
+    enabled = set([f for f in flags if params_dict.get(f, False)])
+
+    if force_redis and (len(enabled & set(['enable_unified_search', 'enable_cognitive_search', 'enable_redis_search', 'use_bing'])) == 0):
+        enabled.add('enable_redis_search')
+
+    return (agent_name, tuple(sorted(enabled)), CHOSEN_COMP_MODEL)
+
+
+
+def get_agent_template(agent_name = "zs", params_dict = {}):
+    key = get_agent_template_key(agent_name, params_dict)
+
+    with agent_templates_lock:
+        if key not in agent_templates:
+            agent_templates[key] = KMOAI_Agent(agent_name = agent_name, params_dict = params_dict, verbose = False)
+
+    return agent_templates[key]
+
+
+
+def create_agent(agent_name = "zs", params_dict = {}, verbose = False):
+    ## cheap per-request agent (memory, filters, connection) on top of a shared template
+    return KMOAI_Agent(agent_name = agent_name, params_dict = params_dict, verbose = verbose, template = get_agent_template(agent_name, params_dict))
 
 
 
 
 class KMOAI_Agent():
 
-    def __init__(self, agent_name = "zs", params_dict={}, verbose=False, stream=False, connection=None, force_redis = True):
+    def __init__(self, agent_name = "zs", params_dict={}, verbose=False, stream=False, connection=None, force_redis = True, template = None):
 
         self.stream = stream
         self.connection = connection
@@ -133,8 +169,12 @@ class KMOAI_Agent():
         else:
             callbacks = [streaming_handler.StreamingSocketIOCallbackHandler(connection['socketio'], connection['connection_id'])]
 
-        self.llm = helpers.get_llm(CHOSEN_COMP_MODEL, temperature=0, max_output_tokens=MAX_OUTPUT_TOKENS, stream=False, callbacks=callbacks)
-        self.llm_math_chain = LLMMathChain(llm=self.llm, verbose=True)
+        if template is None:
+            self.llm = helpers.get_llm(CHOSEN_COMP_MODEL, temperature=0, max_output_tokens=MAX_OUTPUT_TOKENS, stream=False, callbacks=callbacks)
+            self.llm_math_chain = LLMMathChain(llm=self.llm, verbose=True)
+        else:
+            self.llm = template.llm
+            self.llm_math_chain = template.llm_math_chain
 
         self.gen = gen
 
@@ -173,7 +213,7 @@ class KMOAI_Agent():
 
 
         if self.use_bing or (USE_BING == 'yes'):
-            self.bing_search = ModBingSearchAPIWrapper(k=10)
+            self.bing_search = ModBingSearchAPIWrapper(k=10) if (template is None) or (template.bing_search is None) else template.bing_search
             agent_tools.append(Tool(name="Online Search", func=self.agent_bing_search, description='useful for when you need to answer questions about current events from the internet'),)
         else:
             self.bing_search = None
@@ -195,17 +235,21 @@ class KMOAI_Agent():
         self.agent_tools = agent_tools
         
 
-        self.zs_agent = ZSReAct.from_llm_and_tools(self.llm, agent_tools)
-        self.zs_chain = AgentExecutor.from_agent_and_tools(self.zs_agent, agent_tools, verbose=verbose, max_iterations = 4, early_stopping_method="generate")
-
-        self.ccrd_agent = ModConversationalChatAgent.from_llm_and_tools(self.llm, agent_tools)
-        self.ccrd_chain =  AgentExecutor.from_agent_and_tools(self.ccrd_agent, agent_tools, verbose=verbose, max_iterations = 4, early_stopping_method="generate", memory=self.memory)
-
-        completion_enc = openai_helpers.get_encoder(CHOSEN_COMP_MODEL)
+        if template is None:
+            self.zs_agent = ZSReAct.from_llm_and_tools(self.llm, agent_tools)
+            self.ccrd_agent = ModConversationalChatAgent.from_llm_and_tools(self.llm, agent_tools)
 
-        zs_pr = self.zs_agent.create_prompt([]).format(input='', history='', agent_scratchpad='')
+            completion_enc = openai_helpers.get_encoder(CHOSEN_COMP_MODEL)
+            zs_pr = self.zs_agent.create_prompt([]).format(input='', history='', agent_scratchpad='')
+            self.zs_empty_prompt_length = len(completion_enc.encode(zs_pr))
+        else:
+            ## shallow copies share the prompts and LLM chains of the template, the input lengths stay per request
+            self.zs_agent = template.zs_agent.copy()
+            self.ccrd_agent = template.ccrd_agent.copy()
+            self.zs_empty_prompt_length = template.zs_empty_prompt_length
 
-        self.zs_empty_prompt_length = len(completion_enc.encode(zs_pr))
+        self.zs_chain = AgentExecutor.from_agent_and_tools(self.zs_agent, agent_tools, verbose=verbose, max_iterations = 4, early_stopping_method="generate")
+        self.ccrd_chain =  AgentExecutor.from_agent_and_tools(self.ccrd_agent, agent_tools, verbose=verbose, max_iterations = 4, early_stopping_method="generate", memory=self.memory)
 
 
 
@@ -344,17 +388,17 @@ class KMOAI_Agent():
 
         if response is None:
             list_f = ['redis_search', 'cog_lookup', 'cog_search']
-            list_q = [query for f in list_f]
 
             if USE_BING == 'yes':
                 list_f += ['bing_lookup']
-                list_q += [query]
             
-            # print(list_f, list_q)
+            # print(list_f)
 
-            results = pool.starmap(self.specific_search,  zip(list_q, list_f))
+            answered = search_fanout.fan_out([(f, self.specific_search, (query, f)) for f in list_f])
+            results = [answered[f] for f in list_f if f in answered]
+            if self.verbose: print("Search backends answered in time:", list(answered.keys()))
 
-            max_items = max([len(r) for r in results])
+            max_items = max([len(r) for r in results], default=0)
 
             final_context = []
             context_dict = {}
@@ -391,16 +435,6 @@ class KMOAI_Agent():
             if func_name == "bing_lookup": return self.bing_search.run(q)
 
 
-    def replace_occurrences(self, answer, occ):
-        matches = re.findall(occ, answer, re.DOTALL)            
-        for m in matches:
-            try:
-                if isinstance(m, tuple): m = ' '.join(m).rstrip()
-                answer = answer.replace(m, '')        
-            except Exception as e:
-                if self.verbose: print(m, occ, e)
-        return answer
-
     def process_final_response(self, query, response):
 
         # print("Unprocessed response", response)
@@ -410,28 +444,7 @@ class KMOAI_Agent():
         else:    
             answer = response.get('output')
 
-        occurences = [
-            "Action:[\n\r\s]+(.*?)[\n]*[\n\r\s](.*)"
-            "Action Input:[\s\r\n]+",
-            "Action:[\s\r\n]+None needed?.",
-            "Action:[\s\r\n]+None?.",
-            "Action:[\s\r\n]+",
-            "Action [\d]+:",
-            "Action Input:",
-            "Online Search:",
-            "Thought [0-9]+:",
-            "Observation [0-9]+:",
-            "Final Answer:",
-            "Final Answer",
-            "Finish\[",
-            "Human:",
-            "AI:",
-            "--",
-            "###"
-        ]
-
-        for occ in occurences:
-            answer = self.replace_occurrences(answer, occ)
+        answer = text_cleaning.clean_agent_answer(answer)
             
         answer = answer.replace('<|im_end|>', '')
 
@@ -449,6 +462,7 @@ class KMOAI_Agent():
         likely_sources = []
 
         answer_with_sources = copy.deepcopy(answer)
+        self.last_answer_with_sources = answer_with_sources
 
         # source_matches = re.findall(r'\((.*?)\)', answer)  
         source_matches = re.findall(r'\[(.*?)\]', answer)
@@ -483,7 +497,7 @@ class KMOAI_Agent():
             self.memory.save_context({"input": query}, {"output": answer_with_sources})
 
         if answer == 'Agent stopped due to max iterations.':
-            answer = 'I am sorry, I am not able to find an answer to your question. Please try again with a different question.'
+            answer = TECHNICAL_ERROR_RESPONSE
 
 
         return answer, sources, likely_sources
@@ -613,7 +627,7 @@ class KMOAI_Agent():
 
         except Exception as e:
             e_str = str(e)
-            return 'I am sorry, I am not able to find an answer to your question. Please try again with a different question.', [], [f"Technical Error: {e_str}"]
+            return TECHNICAL_ERROR_RESPONSE, [], [f"Technical Error: {e_str}"]
             # response = f"Technical Error: {e_str}"
             print("Exception", response)
         
@@ -720,6 +734,37 @@ class KMOAI_Agent():
         self.redis_conn = redis_conn
         
         hist, prompt_id = self.get_history(prompt_id)
+
+        if USE_ANSWER_CACHE != 1:
+            return self.answer_query(query, hist, prompt_id, filter_param)
+
+        scope = answer_cache.get_scope(self.agent_name, filter_param, hist)
+        query_embedding = embedding_cache.get_query_embedding(query, CHOSEN_EMB_MODEL)
+        guard = answer_cache.get_guard_tokens(query)
+        cached = answer_cache.semantic_cache.lookup(query_embedding, scope, guard)
+
+        if cached is not None:
+            if self.verbose: print(f"Answer cache hit with similarity {cached['similarity']:.3f}")
+            ## the agent did not run, so no chain wrote this turn to memory; every agent type records it here
+            self.memory.save_context({"input": query}, {"output": cached['answer_with_sources']})
+            self.manage_history(hist, cached['sources'], prompt_id)
+            return cached['answer'], cached['sources'], cached['likely_sources'], prompt_id
+
+        self.last_answer_with_sources = None
+        answer, sources, likely_sources, prompt_id = self.answer_query(query, hist, prompt_id, filter_param)
+
+        if answer not in [DEFAULT_RESPONSE, TECHNICAL_ERROR_RESPONSE]:
+            ## what the normal path saved to memory, so later turns see the same history after a hit
+            answer_with_sources = self.last_answer_with_sources if self.last_answer_with_sources is not None else answer
+            value = {'answer': answer, 'answer_with_sources': answer_with_sources, 'sources': sources, 'likely_sources': likely_sources}
+            answer_cache.semantic_cache.store(query_embedding, scope, value, guard)
+
+        return answer, sources, likely_sources, prompt_id
+
+
+
+    def answer_query(self, query, hist, prompt_id, filter_param):
+
         self.history = hist.replace('\n', ' ')
         if self.verbose: print(f"Inserting history: {hist}")
         pre_context = ''
@@ -3,48 +3,102 @@ import requests
 import uuid
 import os
 import logging
+import hashlib
 
 import typing
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.textanalytics import TextAnalyticsClient
 
+from utils import redis_helpers
 from utils.env_vars import *
 
+
+translator_headers = {
+    'Ocp-Apim-Subscription-Key': TRANSLATION_API_KEY,
+    'Ocp-Apim-Subscription-Region': TRANSLATION_LOCATION,
+    'Content-type': 'application/json'
+}
+
+translator_session = requests.Session()
+
+
+def get_translator_headers():
+    return {**translator_headers, 'X-ClientTraceId': str(uuid.uuid4())}
+
+
+def pack_translator_batches(texts, max_texts = TRANSLATION_BATCH_MAX_TEXTS, max_chars = TRANSLATION_BATCH_MAX_CHARS):
+    batch = []
+    batch_chars = 0
+
+    for i, text in enumerate(texts):
+        if (len(batch) > 0) and ((len(batch) >= max_texts) or (batch_chars + len(text) > max_chars)):
+            yield batch
+            batch = []
+            batch_chars = 0
+
+        batch.append(i)
+        batch_chars += len(text)
+
+    if len(batch) > 0:
+        yield batch
+
+
+
 def detect_content_language(content):
-    path = '/detect'
-    constructed_url = TRANSLATION_ENDPOINT + path
+    return detect_content_language_batch([content])[0]
+
+
+
+def detect_content_language_batch(contents):
+    constructed_url = TRANSLATION_ENDPOINT + '/detect'
+    params = {'api-version': '3.0'}
+    langs = ['xx'] * len(contents)
+
+    for batch in pack_translator_batches(contents):
+        body = [{'text': contents[i]} for i in batch]
+
+        try:
+            request = translator_session.post(constructed_url, params=params, headers=get_translator_headers(), json=body)
+            response = request.json()
+            for i, r in zip(batch, response): langs[i] = r['language']
+        except Exception as e:
+            logging.error(f"Language detection failed for a batch of {len(batch)} texts: {e}")
+
+    return langs
 
-    params = {
-        'api-version': '3.0',
-    }
 
-    headers = {
-        'Ocp-Apim-Subscription-Key': TRANSLATION_API_KEY,
-        'Ocp-Apim-Subscription-Region': TRANSLATION_LOCATION,
-        'Content-type': 'application/json',
-        'X-ClientTraceId': str(uuid.uuid4())
-    }
 
-    # You can pass more than one object in body.
-    body = [{'text': content}]
+def get_translation_cache_key(text, from_lang, to_lang):
+    return f"transcache:{from_lang}:{to_lang}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
 
-    request = requests.post(constructed_url, params=params, headers=headers, json=body)
-    response = request.json()
+
+
+def get_cached_translations(redis_conn, keys):
+    if (redis_conn is None) or (USE_REDIS_CACHE != 1) or (len(keys) == 0): return [None] * len(keys)
 
     try:
-        lang = response[0]['language']
-        return lang
-    except: 
-        return 'xx'
+        return [v.decode('utf-8') if v is not None else None for v in redis_conn.mget(keys)]
+    except Exception as e:
+        logging.warning(f"Translation cache lookup failed: {e}")
+        return [None] * len(keys)
 
 
 
+def set_cached_translations(redis_conn, entries):
+    if (redis_conn is None) or (USE_REDIS_CACHE != 1) or (len(entries) == 0): return
 
-def translate(text, from_lang, to_lang = 'en'):
+    try:
+        p = redis_conn.pipeline(transaction=False)
+        for k, v in entries.items(): p.set(k, v, ex=TRANSLATION_CACHE_TTL_SECS)
+        p.execute()
+    except Exception as e:
+        logging.warning(f"Translation cache write failed: {e}")
 
-    path = '/translate'
-    constructed_url = TRANSLATION_ENDPOINT + path
-    body = [{'text': text}]
+
+
+def translate_batch(texts, from_lang, to_lang = 'en'):
+
+    constructed_url = TRANSLATION_ENDPOINT + '/translate'
 
     params = {
         'api-version': '3.0',
@@ -52,22 +106,41 @@ def translate(text, from_lang, to_lang = 'en'):
         'to': [to_lang]
     }
 
-    headers = {
-        'Ocp-Apim-Subscription-Key': TRANSLATION_API_KEY,
-        'Ocp-Apim-Subscription-Region': TRANSLATION_LOCATION,
-        'Content-type': 'application/json',
-        'X-ClientTraceId': str(uuid.uuid4())
-    }
+    redis_conn = redis_helpers.get_new_conn()
+    keys = [get_translation_cache_key(t, from_lang, to_lang) for t in texts]
+    translations = get_cached_translations(redis_conn, keys)
 
-    request = requests.post(constructed_url, params=params, headers=headers, json=body)
-    response = request.json()
+    missing = [i for i, t in enumerate(translations) if t is None]
+    missing_texts = [texts[i] for i in missing]
+    new_entries = {}
 
-    try:
-        # print(response)
-        return response[0]['translations'][0]['text']
-    except Exception as e:
-        print(e)
-        return response
+    for batch in pack_translator_batches(missing_texts):
+        body = [{'text': missing_texts[i]} for i in batch]
+
+        try:
+            request = translator_session.post(constructed_url, params=params, headers=get_translator_headers(), json=body)
+            request.raise_for_status()
+            response = request.json()
+
+            for i, r in zip(batch, response):
+                translations[missing[i]] = r['translations'][0]['text']
+                new_entries[keys[missing[i]]] = translations[missing[i]]
+
+        except Exception as e:
+            print(e)
+            logging.error(f"Translation failed for a batch of {len(batch)} texts: {e}")
+
+    set_cached_translations(redis_conn, new_entries)
+    logging.info(f"Translated {len(texts)} texts, {len(texts) - len(missing)} from cache")
+
+    ## None marks a failed translation, callers decide on a fallback that must not be cached
+    return translations
+
+
+
+def translate(text, from_lang, to_lang = 'en'):
+    translation = translate_batch([text], from_lang, to_lang)[0]
+    return text if translation is None else translation
 
 
 
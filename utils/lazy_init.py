@@ -0,0 +1,43 @@
+import time
+import logging
+import threading
+
+from utils.env_vars import *
+
+
+## Process-wide service clients and deployments, created by their factory on first use and cached.
+## With PROFILE_STARTUP=1 every factory logs how long it took; utils.startup_profiler reports the totals.
+
+resources = {}
+resources_lock = threading.RLock()
+init_timings = {}
+
+
+
+def get_resource(name, factory):
+    if name in resources: return resources[name]
+
+    with resources_lock:
+        if name not in resources:
+            start = time.perf_counter()
+            resources[name] = factory()
+            init_timings[name] = time.perf_counter() - start
+
+            if PROFILE_STARTUP == 1:
+                logging.info(f"Initialized {name} in {init_timings[name]:.3f}s")
+                print(f"Initialized {name} in {init_timings[name]:.3f}s")
+
+    return resources[name]
+
+
+
+def reset_resource(name):
+    with resources_lock:
+        resources.pop(name, None)
+
+
+
+def reset_resources():
+    ## e.g. in a forked worker, which must not reuse the parent's client connections
+    with resources_lock:
+        resources.clear()
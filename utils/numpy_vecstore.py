@@ -0,0 +1,254 @@
+import os
+import re
+import uuid
+import fcntl
+import pickle
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+from utils.env_vars import *
+
+
+## Embedded vector index for deployments without Redis Stack (VECTOR_BACKEND=numpy).
+## Vectors live L2-normalized in a contiguous float32 matrix, memory-mapped on load; the chunk fields live
+## in a pickled list in the same row order. Every save writes both files under a new version and then
+## switches the NUMPY_INDEX_PATH/current stamp in one rename, so readers never pair vectors and metadata
+## of different saves. Upserts are buffered and merged into the matrix once per document by flush().
+## Every reload-merge-save runs under an flock on NUMPY_INDEX_PATH/lock, so concurrent writer processes
+## (e.g. the utils.bulk_ingest workers) merge into each other's saves instead of overwriting them.
+
+store_lock = threading.Lock()
+stores = {}
+
+
+
+def parse_filter(filter_param):
+    if (filter_param is None) or (filter_param.strip() == '*') or (filter_param.strip() == ''): return []
+
+    clauses = []
+    for field, value in re.findall(r"@(\w+):\s*(\{[^}]*\}|\([^)]*\)|\S+)", filter_param):
+        value = value.strip('{}()').replace('\\-', '-')
+        clauses.append((field, [t for t in re.split(r'\W+', value.lower()) if t != '']))
+
+    return clauses
+
+
+
+def match_filter(doc, clauses):
+    ## same semantics as a RediSearch text field match: every token of the value appears in the field
+    for field, tokens in clauses:
+        field_tokens = set(re.split(r'\W+', str(doc.get(field, '')).lower()))
+        if not all([t in field_tokens for t in tokens]): return False
+
+    return True
+
+
+
+class NumpyVecStore:
+
+    def __init__(self, path = NUMPY_INDEX_PATH):
+        self.path = path
+        self.version_file = os.path.join(path, 'current')
+        self.lock_file = os.path.join(path, 'lock')
+        self.lock = threading.RLock()
+        self.vectors = None
+        self.metadata = []
+        self.id_rows = {}
+        self.version = None
+        self.pending = {}
+        self.load()
+
+
+    def get_files(self, version):
+        return os.path.join(self.path, f'vectors-{version}.npy'), os.path.join(self.path, f'metadata-{version}.pkl')
+
+
+    def read_version(self):
+        if not os.path.exists(self.version_file): return None
+        with open(self.version_file, 'r') as f:
+            return f.read().strip()
+
+
+    def load(self):
+        for _ in range(3):
+            version = self.read_version()
+
+            if version is None:
+                self.vectors = np.zeros((0, 0), dtype=np.float32)
+                self.metadata = []
+                break
+
+            vectors_file, metadata_file = self.get_files(version)
+            try:
+                vectors = np.load(vectors_file, mmap_mode='r')
+                with open(metadata_file, 'rb') as f:
+                    metadata = pickle.load(f)
+            except FileNotFoundError:
+                ## another process saved a newer version and removed this one in between, read the stamp again
+                continue
+
+            self.vectors, self.metadata = vectors, metadata
+            break
+
+        self.version = version
+        self.id_rows = {m['id']: i for i, m in enumerate(self.metadata)}
+
+
+    def reload_if_changed(self):
+        if self.read_version() != self.version:
+            self.load()
+
+
+    @contextmanager
+    def write_lock(self):
+        ## in-process lock first, then the cross-process one
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.lock_file, 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+    def write_file(self, path, write):
+        with open(path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def save(self, vectors, metadata):
+        ## caller holds write_lock
+        os.makedirs(self.path, exist_ok=True)
+        previous = self.version
+        version = uuid.uuid4().hex
+        vectors_file, metadata_file = self.get_files(version)
+
+        self.write_file(vectors_file, lambda f: np.save(f, vectors))
+        self.write_file(metadata_file, lambda f: pickle.dump(metadata, f))
+        self.write_file(self.version_file + '.tmp', lambda f: f.write(version.encode('utf-8')))
+
+        os.replace(self.version_file + '.tmp', self.version_file)
+        self.load()
+
+        if previous is not None:
+            for old_file in self.get_files(previous):
+                try:
+                    os.remove(old_file)
+                except OSError as e:
+                    logging.warning(f"Could not remove old numpy index file {old_file}: {e}")
+
+
+    def snapshot(self):
+        with self.lock:
+            self.reload_if_changed()
+            return self.vectors, self.metadata
+
+
+    def upsert_documents(self, emb_documents):
+        ## buffered only, flush() writes them
+        docs = [e for e in emb_documents if isinstance(e.get(VECTOR_FIELD_IN_REDIS, None), list) and (len(e[VECTOR_FIELD_IN_REDIS]) > 0)]
+        if len(docs) == 0: return 0
+
+        with self.lock:
+            for e in docs:
+                self.pending[e['id']] = (e[VECTOR_FIELD_IN_REDIS], {k: v for k, v in e.items() if not isinstance(v, list)})
+
+        return len(docs)
+
+
+    def merge(self, delete_ids = set()):
+        ## current rows minus the deleted and re-upserted ids, plus the buffered upserts; caller holds write_lock
+        new_vectors = np.asarray([v for v, _ in self.pending.values()], dtype=np.float32)
+        new_metadata = [m for _, m in self.pending.values()]
+        if len(new_metadata) > 0:
+            new_vectors = new_vectors / np.maximum(np.linalg.norm(new_vectors, axis=1, keepdims=True), 1e-12)
+
+        drop = set(delete_ids) | set(self.pending.keys())
+        keep = [i for i, m in enumerate(self.metadata) if m['id'] not in drop]
+
+        if len(keep) == 0:
+            vectors = new_vectors
+        elif len(new_metadata) == 0:
+            vectors = np.asarray(self.vectors[keep])
+        else:
+            vectors = np.concatenate([np.asarray(self.vectors[keep]), new_vectors])
+
+        self.save(vectors, [self.metadata[i] for i in keep] + new_metadata)
+        self.pending = {}
+
+
+    def flush(self):
+        with self.lock:
+            if len(self.pending) == 0: return 0
+
+        with self.write_lock():
+            if len(self.pending) == 0: return 0
+
+            flushed = len(self.pending)
+            self.reload_if_changed()
+            self.merge()
+
+        logging.info(f"Flushed {flushed} chunks into the numpy index")
+        return flushed
+
+
+    def delete_documents(self, ids):
+        with self.write_lock():
+            self.reload_if_changed()
+            ids = set(ids)
+            for i in ids: self.pending.pop(i, None)
+
+            deleted = len([1 for m in self.metadata if m['id'] in ids])
+            if (deleted == 0) and (len(self.pending) == 0): return 0
+
+            self.merge(delete_ids = ids)
+
+        return deleted
+
+
+    def get_doc_chunks(self, doc_id):
+        _, metadata = self.snapshot()
+        return {m['id']: m.get('text_en', '') for m in metadata if m['id'].startswith(f"{doc_id}_")}
+
+
+    def search(self, query_embs, topK = NUM_TOP_MATCHES, filter_param = None):
+        ## query_embs is a single vector or a batch of vectors, returns one result list per query
+        ## vectors and metadata are taken together under the lock, a concurrent save only swaps in new objects
+        vectors, metadata = self.snapshot()
+
+        queries = np.asarray(query_embs, dtype=np.float32)
+        single = (queries.ndim == 1)
+        if single: queries = queries.reshape(1, -1)
+
+        if len(metadata) == 0:
+            return [] if single else [[] for _ in queries]
+
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ vectors.T
+
+        clauses = parse_filter(filter_param)
+        if len(clauses) > 0:
+            mask = np.array([match_filter(m, clauses) for m in metadata])
+            scores[:, ~mask] = -np.inf
+
+        k = min(topK, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for q in range(len(queries)):
+            rows = sorted(top[q], key=lambda r: -scores[q, r])
+            results.append([{**metadata[r], 'vector_score': str(1 - scores[q, r])} for r in rows if scores[q, r] != -np.inf])
+
+        return results[0] if single else results
+
+
+
+def get_store(path = NUMPY_INDEX_PATH):
+    with store_lock:
+        if path not in stores: stores[path] = NumpyVecStore(path)
+    return stores[path]
@@ -7,6 +7,7 @@ import logging
 
 from tenacity import (
     retry,
+    retry_if_exception_type,
     stop_after_attempt,
     wait_random_exponential,
 )
@@ -27,6 +28,7 @@ from langchain.schema import (
     SystemMessage
 )
 
+from utils import lazy_init
 from utils.env_vars import *
 
 
@@ -95,8 +97,8 @@ def check_model_deployment(oai_model):
 
 
 
-completion_deployment_id = check_model_deployment(CHOSEN_COMP_MODEL)
-embedding_deployment_id = check_model_deployment(CHOSEN_EMB_MODEL)
+def get_deployment_id(oai_model):
+    return lazy_init.get_resource(f"openai_deployment:{oai_model}", lambda: check_model_deployment(oai_model))
 
 
 
@@ -231,7 +233,66 @@ def get_token_length(text, model = CHOSEN_COMP_MODEL):
 
 @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(30))
 def get_openai_embedding(query, embedding_model = CHOSEN_EMB_MODEL):
-    return openai.Embedding.create(input=query, engine=embedding_deployment_id)['data'][0]['embedding']
+    return openai.Embedding.create(input=query, engine=get_deployment_id(CHOSEN_EMB_MODEL))['data'][0]['embedding']
+
+
+
+def pack_embedding_batches(texts, embedding_model = CHOSEN_EMB_MODEL, token_counts = None, max_inputs = EMB_BATCH_MAX_INPUTS, max_tokens = EMB_BATCH_MAX_TOKENS):
+    if token_counts is None:
+        enc = get_encoder(embedding_model)
+        token_counts = [len(enc.encode(t)) for t in texts]
+
+    batch = []
+    batch_tokens = 0
+
+    for text, n_tokens in zip(texts, token_counts):
+        if (len(batch) > 0) and ((len(batch) >= max_inputs) or (batch_tokens + n_tokens > max_tokens)):
+            yield batch
+            batch = []
+            batch_tokens = 0
+
+        batch.append(text)
+        batch_tokens += n_tokens
+
+    if len(batch) > 0:
+        yield batch
+
+
+
+## throttling and service-side failures are worth retrying, anything else would fail again the same way
+transient_openai_errors = (openai.error.RateLimitError, openai.error.Timeout, openai.error.APIConnectionError,
+                           openai.error.ServiceUnavailableError, openai.error.TryAgain, openai.error.APIError)
+
+
+
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6), retry=retry_if_exception_type(transient_openai_errors))
+def get_openai_embedding_batch(texts, embedding_model = CHOSEN_EMB_MODEL):
+    data = openai.Embedding.create(input=texts, engine=get_deployment_id(CHOSEN_EMB_MODEL))['data']
+    assert len(data) == len(texts), f"Embedding batch returned {len(data)} vectors for {len(texts)} inputs"
+    return [d['embedding'] for d in sorted(data, key=lambda d: d['index'])]
+
+
+
+def embed_batch_with_split(texts, embedding_model = CHOSEN_EMB_MODEL):
+    ## only a rejected request is split, to isolate the input that the service refuses
+    try:
+        return get_openai_embedding_batch(texts, embedding_model)
+    except openai.error.InvalidRequestError as e:
+        if len(texts) == 1: raise
+
+        logging.warning(f"Embedding batch of {len(texts)} inputs failed, splitting: {e}")
+        half = len(texts) // 2
+        return embed_batch_with_split(texts[:half], embedding_model) + embed_batch_with_split(texts[half:], embedding_model)
+
+
+
+def get_openai_embeddings(texts, embedding_model = CHOSEN_EMB_MODEL, token_counts = None):
+    embeddings = []
+
+    for batch in pack_embedding_batches(texts, embedding_model, token_counts):
+        embeddings += embed_batch_with_split(batch, embedding_model)
+
+    return embeddings
 
 
 
@@ -276,7 +337,7 @@ def contact_openai(prompt, completion_model = CHOSEN_COMP_MODEL, max_output_toke
                             temperature=TEMPERATURE,
                             max_tokens=max_output_tokens,
                             model=completion_model,
-                            deployment_id=completion_deployment_id,
+                            deployment_id=get_deployment_id(CHOSEN_COMP_MODEL),
                             stream = stream
                         )
 
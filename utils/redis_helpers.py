@@ -1,9 +1,10 @@
 import os
 import numpy as np
 import redis
-from redis import Redis
 import logging
 import copy
+import time
+import threading
 from redis.commands.search.field import VectorField
 from redis.commands.search.field import TextField
 from redis.commands.search.field import TagField
@@ -17,6 +18,7 @@ from redis.commands.search.result import Result
 
 
 from utils.kb_doc import KB_Doc
+from utils import vector_quantization
 
 from tenacity import (
     retry,
@@ -43,7 +45,7 @@ def create_search_index (redis_new_conn, vector_field_name, number_of_vectors, v
     M=40
     EF=200
 
-    fields = [VectorField(vector_field_name, "HNSW", {"TYPE": "FLOAT32", "DIM": vector_dimensions, "DISTANCE_METRIC": distance_metric, "INITIAL_CAP": number_of_vectors, "M": M, "EF_CONSTRUCTION": EF})] + \
+    fields = [VectorField(vector_field_name, "HNSW", {"TYPE": REDIS_VECTOR_TYPE, "DIM": vector_dimensions, "DISTANCE_METRIC": distance_metric, "INITIAL_CAP": number_of_vectors, "M": M, "EF_CONSTRUCTION": EF})] + \
              [TextField(f) for f in KB_Doc().get_fields() if f != VECTOR_FIELD_IN_REDIS]
 
     redis_new_conn.ft(REDIS_INDEX_NAME).create_index(fields)
@@ -69,7 +71,7 @@ def redis_reset_index(redis_new_conn):
     redis_new_conn.flushall()
 
     #create flat index & load vectors
-    create_search_index(redis_new_conn,VECTOR_FIELD_IN_REDIS, NUMBER_PRODUCTS_INDEX, get_model_dims(CHOSEN_EMB_MODEL), 'COSINE')
+    create_search_index(redis_new_conn,VECTOR_FIELD_IN_REDIS, NUMBER_PRODUCTS_INDEX, vector_quantization.get_index_dims(get_model_dims(CHOSEN_EMB_MODEL)), 'COSINE')
 
 
 def test_redis(redis_new_conn):
@@ -84,20 +86,85 @@ def test_redis(redis_new_conn):
         redis_reset_index(redis_new_conn)
 
 
+## one process-wide pool, connections are checked out per command; the index check runs once per process
+## and is re-run only when a search reports the index missing. A missing index is recreated on its own,
+## without flushing the caches, chat history and locks that share this Redis.
+redis_pool = None
+redis_pool_lock = threading.Lock()
+index_checked = False
+
+
+
+def get_connection_pool():
+    global redis_pool
+
+    with redis_pool_lock:
+        if redis_pool is None:
+            if REDIS_PASSWORD == '':
+                redis_pool = redis.BlockingConnectionPool(host=REDIS_ADDR, port=int(REDIS_PORT), max_connections=REDIS_POOL_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT_SECS)
+            else:
+                redis_pool = redis.BlockingConnectionPool(host=REDIS_ADDR, port=int(REDIS_PORT), password=REDIS_PASSWORD, connection_class=redis.SSLConnection, max_connections=REDIS_POOL_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT_SECS)
+
+    return redis_pool
+
+
+
+def recreate_index(redis_conn):
+    try:
+        redis_conn.ft(REDIS_INDEX_NAME).dropindex(delete_documents=False)
+    except redis.exceptions.ResponseError:
+        pass
+
+    create_search_index(redis_conn, VECTOR_FIELD_IN_REDIS, NUMBER_PRODUCTS_INDEX, vector_quantization.get_index_dims(get_model_dims(CHOSEN_EMB_MODEL)), 'COSINE')
+
+
+
+def ensure_index_checked(redis_conn, force = False):
+    global index_checked
+
+    if index_checked and not force: return
+
+    try:
+        redis_conn.ft(REDIS_INDEX_NAME).info()
+    except redis.exceptions.ResponseError as e:
+        logging.error(f"Redis Index {REDIS_INDEX_NAME} not found, recreating the index only: {e}")
+        recreate_index(redis_conn)
+
+    index_checked = True
+
+
+
 def get_new_conn():
     if (REDIS_ADDR is None) or (REDIS_ADDR == ''): return None
 
-    if REDIS_PASSWORD == '':
-        redis_conn = Redis(host = REDIS_ADDR, port = REDIS_PORT)
-    else:
-        redis_conn = redis.StrictRedis(host=REDIS_ADDR, port=int(REDIS_PORT), password=REDIS_PASSWORD, ssl=True)
+    redis_conn = redis.StrictRedis(connection_pool=get_connection_pool())
 
     #print('Connected to redis', redis_conn)
-    test_redis(redis_conn)
+    ensure_index_checked(redis_conn)
     
     return redis_conn
 
 
+
+def get_pool_stats():
+    ## created/idle come from redis-py internals, which differ across versions; report them only when present
+    if redis_pool is None: return {}
+
+    stats = {'max_connections': getattr(redis_pool, 'max_connections', None)}
+
+    try:
+        connections = getattr(redis_pool, '_connections', None)
+        queue = getattr(getattr(redis_pool, 'pool', None), 'queue', None)
+
+        if connections is not None: stats['created'] = len(connections)
+        if queue is not None: stats['idle'] = len([c for c in list(queue) if c is not None])
+        if ('created' in stats) and ('idle' in stats): stats['in_use'] = stats['created'] - stats['idle']
+    except Exception as e:
+        logging.warning(f"Redis pool stats lookup failed: {e}")
+
+    return stats
+
+
 @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(4))
 def redis_upsert_embedding(redis_conn, e_dict):   
     if (REDIS_ADDR is None) or (REDIS_ADDR == ''): return None
@@ -109,7 +176,8 @@ def redis_upsert_embedding(redis_conn, e_dict):
 
         for k in e: 
             if isinstance(e[k], list) and (len(e[k]) > 0):
-                if isinstance(e[k][0], float): e[k] = np.array(e[k]).astype(np.float32).tobytes()
+                if isinstance(e[k][0], float) and (k == VECTOR_FIELD_IN_REDIS): e[k] = vector_quantization.vector_to_bytes(e[k])
+                elif isinstance(e[k][0], float): e[k] = np.array(e[k]).astype(np.float32).tobytes()
                 if isinstance(e[k][0], str): e[k] = ', '.join(e[k])
 
         # e[VECTOR_FIELD_IN_REDIS] = np.array(e[VECTOR_FIELD_IN_REDIS]).astype(np.float32).tobytes()
@@ -130,6 +198,103 @@ def redis_upsert_embedding(redis_conn, e_dict):
 
 
 
+def get_redis_mappings(emb_documents):
+    mappings = [dict(e) for e in emb_documents]
+
+    float_fields = set([k for e in mappings for k in e if isinstance(e[k], list) and (len(e[k]) > 0) and isinstance(e[k][0], float)])
+
+    for k in float_fields:
+        rows = [i for i, e in enumerate(mappings) if isinstance(e.get(k, None), list) and (len(e[k]) > 0)]
+
+        try:
+            matrix = np.asarray([mappings[i][k] for i in rows], dtype=np.float32)
+            if k == VECTOR_FIELD_IN_REDIS: matrix = vector_quantization.compact_vectors(matrix)
+            for i, row in zip(rows, matrix): mappings[i][k] = row.tobytes()
+        except ValueError:
+            # vectors of different lengths under the same field, convert one by one
+            for i in rows: mappings[i][k] = vector_quantization.vector_to_bytes(mappings[i][k]) if k == VECTOR_FIELD_IN_REDIS else np.array(mappings[i][k]).astype(np.float32).tobytes()
+
+    valid = []
+
+    for e in mappings:
+        for k in e:
+            if isinstance(e[k], list) and (len(e[k]) > 0) and isinstance(e[k][0], str): e[k] = ', '.join(e[k])
+
+        if any([isinstance(e[k], list) for k in e]):
+            logging.error(f"Embedding Except: document {e.get('id', '')} has list fields that cannot be stored in Redis")
+            continue
+
+        valid.append(e)
+
+    return valid
+
+
+
+@retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(4))
+def redis_execute_hset_batch(redis_conn, mappings):
+    p = redis_conn.pipeline(transaction=False)
+    for e in mappings: p.hset(e['id'], mapping=e)
+    p.execute()
+    return len(mappings)
+
+
+
+def redis_bulk_upsert_embeddings(redis_conn, emb_documents, batch_size = REDIS_BULK_BATCH_SIZE, document_name = ''):
+    if (REDIS_ADDR is None) or (REDIS_ADDR == ''): return 0
+
+    loaded = 0
+
+    for i in range(0, len(emb_documents), batch_size):
+        start = time.time()
+
+        try:
+            mappings = get_redis_mappings(emb_documents[i:i+batch_size])
+            count = redis_execute_hset_batch(redis_conn, mappings)
+        except Exception as e:
+            print(f"Embedding Except: {e}")
+            logging.error(f"Embedding Except: {e}")
+            continue
+
+        loaded += count
+        elapsed = max(time.time() - start, 1e-6)
+        logging.info(f"Loaded {count} embeddings into Redis in {elapsed:.2f}s ({count / elapsed:.0f} embeddings/s) for document {document_name}, total {loaded} of {len(emb_documents)}")
+
+    return loaded
+
+
+
+def redis_get_doc_chunks(redis_conn, doc_id, suffixes = ['S', 'M', 'L', 'XL'], probe_size = 100):
+    if (REDIS_ADDR is None) or (REDIS_ADDR == ''): return {}
+
+    ## chunk ids are {doc_id}_{suffix}_{n} with n contiguous from 0, so probe each tier until the first gap
+    chunks = {}
+
+    for suffix in suffixes:
+        n = 0
+
+        while True:
+            ids = [f"{doc_id}_{suffix}_{i}" for i in range(n, n + probe_size)]
+            p = redis_conn.pipeline(transaction=False)
+            for i in ids: p.hget(i, 'text_en')
+            texts = p.execute()
+
+            for i, t in zip(ids, texts):
+                if t is None: break
+                chunks[i] = t.decode('utf-8') if isinstance(t, bytes) else t
+
+            if None in texts: break
+            n += probe_size
+
+    return chunks
+
+
+
+def redis_delete_keys(redis_conn, keys):
+    if (REDIS_ADDR is None) or (REDIS_ADDR == '') or (len(keys) == 0): return 0
+    return redis_conn.delete(*keys)
+
+
+
 @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(4))
 def redis_query_embedding_index(redis_conn, query_emb, t_id, topK=5, filter_param=None):
     if (REDIS_ADDR is None) or (REDIS_ADDR == ''): return None
@@ -142,17 +307,38 @@ def redis_query_embedding_index(redis_conn, query_emb, t_id, topK=5, filter_para
 
     filter_param = filter_param.replace('-', '\-')
     fields = list(KB_Doc().get_fields()) + ['vector_score']
-    query_vector = np.array(query_emb).astype(np.float32).tobytes()
+    query_vector = vector_quantization.vector_to_bytes(query_emb)
     query_string = f'({filter_param})=>[KNN {topK} @{VECTOR_FIELD_IN_REDIS} $vec_param AS vector_score]'
 
     q = Query(query_string).sort_by('vector_score').paging(0,topK).return_fields(*fields).dialect(2)
     params_dict = {"vec_param": query_vector}
-    results = redis_conn.ft(REDIS_INDEX_NAME).search(q, query_params = params_dict)
+
+    try:
+        results = redis_conn.ft(REDIS_INDEX_NAME).search(q, query_params = params_dict)
+    except redis.exceptions.ResponseError as e:
+        if 'no such index' not in str(e).lower(): raise
+        logging.error(f"Redis Index {REDIS_INDEX_NAME} disappeared, re-validating it: {e}")
+        ensure_index_checked(redis_conn, force = True)
+        results = redis_conn.ft(REDIS_INDEX_NAME).search(q, query_params = params_dict)
     
     return [{k: match.__dict__[k] for k in (set(list(match.__dict__.keys())) - set([VECTOR_FIELD_IN_REDIS]))} for match in results.docs if match.id != t_id]
 
 
 
+def get_index_doc_count(redis_conn):
+    ## 0 when the index is missing, None when the count could not be read
+    try:
+        return int(redis_conn.ft(REDIS_INDEX_NAME).info()['num_docs'])
+    except redis.exceptions.ResponseError as e:
+        if ('no such index' in str(e).lower()) or ('unknown index' in str(e).lower()): return 0
+        logging.warning(f"Could not read the document count of Redis Index {REDIS_INDEX_NAME}: {e}")
+        return None
+    except Exception as e:
+        logging.warning(f"Could not read the document count of Redis Index {REDIS_INDEX_NAME}: {e}")
+        return None
+
+
+
 @retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(4))
 def redis_set(redis_conn, key, field, value, expiry = None, verbose = False):
     if (REDIS_ADDR is None) or (REDIS_ADDR == '') or (USE_REDIS_CACHE != 1): return None
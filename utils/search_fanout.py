@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.env_vars import *
+
+
+## Fan-out of one query to several search backends. Every backend runs under its own deadline, capped by
+## the overall latency budget; whatever finished in time is returned and late backends are abandoned.
+## With FANOUT_HEDGE_AFTER_SECS > 0 a backend still running after that delay gets a second, identical
+## request and the first answer wins.
+##
+## Each backend has its own bounded executor (FANOUT_BACKEND_WORKERS), so abandoned calls of a slow
+## service only tie up that service's workers. A saturated backend is skipped instead of queued, and
+## is never hedged. Exactly one outcome per backend call (ok, error, timeout, saturated) is recorded,
+## with its latency measured from submission.
+
+backends = {}
+backends_lock = threading.Lock()
+
+latencies = {}
+latencies_lock = threading.Lock()
+
+
+
+def parse_backend_timeouts(timeouts = FANOUT_BACKEND_TIMEOUTS):
+    ## "redis_search:3,cog_search:5" -> {'redis_search': 3.0, 'cog_search': 5.0}
+    parsed = {}
+    for item in timeouts.split(','):
+        if ':' not in item: continue
+        name, secs = item.split(':', 1)
+        parsed[name.strip()] = float(secs)
+    return parsed
+
+
+backend_timeouts = parse_backend_timeouts()
+
+
+
+class BackendPool:
+
+    def __init__(self, name, max_workers = FANOUT_BACKEND_WORKERS):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"fanout-{name}")
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+
+    def try_submit(self, func, args):
+        ## None when every worker is busy, a queued call would only wait behind abandoned work
+        with self.lock:
+            if self.in_flight >= self.max_workers: return None
+            self.in_flight += 1
+
+        return self.executor.submit(self.run, func, args)
+
+
+    def run(self, func, args):
+        try:
+            return func(*args), None, time.perf_counter()
+        except Exception as e:
+            return None, e, time.perf_counter()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+
+def get_backend_pool(name):
+    with backends_lock:
+        if name not in backends: backends[name] = BackendPool(name)
+    return backends[name]
+
+
+
+def record_latency(name, secs, status):
+    with latencies_lock:
+        if name not in latencies: latencies[name] = deque(maxlen=FANOUT_LATENCY_WINDOW)
+        latencies[name].append((secs, status))
+
+
+
+def get_latency_stats():
+    with latencies_lock:
+        snapshot = {name: list(samples) for name, samples in latencies.items()}
+
+    stats = {}
+    for name, samples in snapshot.items():
+        secs = np.array([s for s, _ in samples])
+        stats[name] = {
+            'count': len(samples),
+            'timeouts': len([1 for _, status in samples if status == 'timeout']),
+            'errors': len([1 for _, status in samples if status == 'error']),
+            'saturated': len([1 for _, status in samples if status == 'saturated']),
+            'p50': float(np.percentile(secs, 50)),
+            'p95': float(np.percentile(secs, 95)),
+            'p99': float(np.percentile(secs, 99))
+        }
+
+    with backends_lock:
+        for name, pool in backends.items():
+            if name in stats: stats[name]['in_flight'] = pool.in_flight
+
+    return stats
+
+
+
+def fan_out(calls, budget = FANOUT_BUDGET_SECS, hedge_after = FANOUT_HEDGE_AFTER_SECS):
+    ## calls is a list of (name, func, args), returns {name: result} for the backends that answered in time
+    start = time.perf_counter()
+    deadlines = {name: min(backend_timeouts.get(name, FANOUT_DEFAULT_TIMEOUT_SECS), budget) for name, _, _ in calls}
+    specs = {name: (func, args) for name, func, args in calls}
+
+    pending = {}
+    for name, func, args in calls:
+        f = get_backend_pool(name).try_submit(func, args)
+        if f is None:
+            record_latency(name, 0.0, 'saturated')
+            logging.warning(f"Search backend {name} is saturated, skipping it")
+        else:
+            pending[f] = name
+
+    results = {}
+    hedged = set()
+    open_names = set(pending.values())
+
+    while len(open_names) > 0:
+        elapsed = time.perf_counter() - start
+
+        events = [deadlines[n] for n in open_names]
+        if hedge_after > 0: events += [hedge_after for n in open_names if n not in hedged]
+        next_event = min([e for e in events if e > elapsed], default=elapsed)
+
+        done, _ = wait(list(pending.keys()), timeout=max(next_event - elapsed, 0), return_when=FIRST_COMPLETED)
+
+        for f in done:
+            name = pending.pop(f)
+            if name not in open_names: continue
+
+            result, error, finished = f.result()
+
+            if error is None:
+                results[name] = result
+                open_names.discard(name)
+                record_latency(name, finished - start, 'ok')
+            elif name not in pending.values():
+                ## no other attempt of this backend is still running
+                open_names.discard(name)
+                record_latency(name, finished - start, 'error')
+                logging.warning(f"Search backend {name} failed: {error}")
+
+        elapsed = time.perf_counter() - start
+
+        if hedge_after > 0:
+            for name in open_names - hedged:
+                if (elapsed >= hedge_after) and (elapsed < deadlines[name]):
+                    hedged.add(name)
+                    func, args = specs[name]
+                    f = get_backend_pool(name).try_submit(func, args)
+                    if f is None: continue
+                    pending[f] = name
+                    logging.info(f"Hedging search backend {name} after {elapsed:.2f}s")
+
+        for name in list(open_names):
+            if elapsed >= deadlines[name]:
+                open_names.discard(name)
+                record_latency(name, deadlines[name], 'timeout')
+                logging.warning(f"Search backend {name} missed its {deadlines[name]}s deadline")
+
+        ## abandoned and losing attempts keep running in their backend's own pool, nobody waits for them
+        pending = {f: n for f, n in pending.items() if n in open_names}
+
+    return results
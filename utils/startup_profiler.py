@@ -0,0 +1,89 @@
+## Cold start profile: import cost per module, then the cost of initializing each lazy resource.
+##
+## python -m utils.startup_profiler
+## python -m utils.startup_profiler --modules utils.helpers,utils.km_agents --init
+##
+## Modules are imported in the given order, so a module's time excludes whatever earlier modules
+## already imported. With --init the lazy clients are created too and their init times reported.
+
+import os
+import time
+import argparse
+import importlib
+
+
+default_modules = [
+    'utils.env_vars',
+    'utils.openai_helpers',
+    'utils.redis_helpers',
+    'utils.storage',
+    'utils.cosmos_helpers',
+    'utils.cogsearch_helpers',
+    'utils.fr_helpers',
+    'utils.helpers',
+    'utils.km_agents',
+    'utils.bot_helpers'
+    ]
+
+
+
+def profile_imports(modules = default_modules):
+    timings = []
+
+    for m in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(m)
+            timings.append((m, time.perf_counter() - start, ''))
+        except Exception as e:
+            timings.append((m, time.perf_counter() - start, str(e)))
+
+    return timings
+
+
+
+def profile_inits():
+    from utils import openai_helpers, storage, cosmos_helpers, cogsearch_helpers, fr_helpers
+    from utils.env_vars import CHOSEN_COMP_MODEL, CHOSEN_EMB_MODEL, DATABASE_MODE
+
+    inits = [
+        ('openai completion deployment', lambda: openai_helpers.get_deployment_id(CHOSEN_COMP_MODEL)),
+        ('openai embedding deployment', lambda: openai_helpers.get_deployment_id(CHOSEN_EMB_MODEL)),
+        ('blob service client', storage.get_blob_service_client),
+        ('cogsearch semantic search client', cogsearch_helpers.get_sem_search_client),
+        ('cogsearch admin client', cogsearch_helpers.get_admin_client),
+        ('form recognizer client', fr_helpers.get_document_analysis_client),
+    ]
+    if DATABASE_MODE == 1: inits.append(('cosmos container', cosmos_helpers.get_container))
+
+    timings = []
+    for name, init in inits:
+        start = time.perf_counter()
+        try:
+            init()
+            timings.append((name, time.perf_counter() - start, ''))
+        except Exception as e:
+            timings.append((name, time.perf_counter() - start, str(e)))
+
+    return timings
+
+
+
+def print_timings(title, timings):
+    print(f"\n{title}")
+    for name, secs, error in sorted(timings, key=lambda t: -t[1]):
+        print(f"  {secs:8.3f}s  {name}" + (f"  (failed: {error})" if error != '' else ''))
+    print(f"  {sum([t[1] for t in timings]):8.3f}s  total")
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report per-module import and lazy init cost')
+    parser.add_argument('--modules', default=','.join(default_modules), help='comma separated modules, imported in this order')
+    parser.add_argument('--init', action='store_true', help='also create the lazily initialized service clients')
+    args = parser.parse_args()
+
+    os.environ['PROFILE_STARTUP'] = '1'
+
+    print_timings('Import cost per module', profile_imports(args.modules.split(',')))
+    if args.init: print_timings('Init cost per lazy resource', profile_inits())
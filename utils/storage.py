@@ -9,10 +9,14 @@ import smart_open
 from azure.storage.blob import BlobServiceClient, BlobClient
 from azure.storage.blob import ContainerClient, __version__
 from azure.storage.blob import generate_blob_sas, BlobSasPermissions
-import copy
 import uuid
 import json
+import gzip
+import threading
+from collections import OrderedDict
+from azure.storage.blob import ContentSettings
 
+from utils import lazy_init
 from utils.env_vars import *
 
 
@@ -21,27 +25,59 @@ def get_kb_container_client():
     return blob_service_client
 
 
-blob_service_client = get_kb_container_client()
+def get_blob_service_client():
+    return lazy_init.get_resource('blob_service_client', get_kb_container_client)
+
+## container clients whose container has been verified (or created) by this process
+container_clients = {}
+container_clients_lock = threading.Lock()
 
 
 def get_container_name(url):
     return url.split('.blob.core.windows.net/')[1].split('/')[0]
 
 
-def create_sas_from_container_and_blob(container, blob_name):
-    blob_client = blob_service_client.get_blob_client(container=container, blob=blob_name)
+## signed SAS urls by (container, blob, permission), refreshed when they get close to their expiry
+sas_cache = OrderedDict()
+sas_cache_lock = threading.Lock()
+
+
+
+def sign_sas_url(container, blob_name, permission = 'r'):
+    blob_client = get_blob_service_client().get_blob_client(container=container, blob=blob_name)
+    expiry = datetime.utcnow() + timedelta(hours=SAS_EXPIRY_HOURS)
 
     token = generate_blob_sas(
             account_name=blob_client.account_name,
             account_key=blob_client.credential.account_key,
             container_name=container,
             blob_name=blob_name,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=20*365*24),
+            permission=BlobSasPermissions.from_string(permission),
+            expiry=expiry,
         )
     
     sas_url = blob_client.url + '?' + token
     #print(f"Processing now '{blob_name}' with SAS URL {sas_url}")
+    return sas_url, expiry
+
+
+
+def create_sas_from_container_and_blob(container, blob_name, permission = 'r'):
+    key = (container, blob_name, permission)
+    refresh_after = datetime.utcnow() + timedelta(seconds=SAS_REFRESH_MARGIN_SECS)
+
+    with sas_cache_lock:
+        if (key in sas_cache) and (sas_cache[key][1] > refresh_after):
+            sas_cache.move_to_end(key)
+            return sas_cache[key][0]
+
+    sas_url, expiry = sign_sas_url(container, blob_name, permission)
+
+    with sas_cache_lock:
+        sas_cache[key] = (sas_url, expiry)
+        sas_cache.move_to_end(key)
+        while len(sas_cache) > SAS_CACHE_MAX_ENTRIES: sas_cache.popitem(last=False)
+
     return sas_url
 
 
@@ -61,32 +97,63 @@ def create_sas(blob_path):
 
 
 
+def get_container_client(container):
+    with container_clients_lock:
+        if container not in container_clients:
+            container_client = get_blob_service_client().get_container_client(container)
+
+            try:
+                container_properties = container_client.get_container_properties() 
+            except Exception as e:
+                container_client.create_container()
+
+            container_clients[container] = container_client
+
+    return container_clients[container]
+
+
+
+def encode_json_document(doc, output_format = JSON_OUTPUT_FORMAT):
+    if output_format == 'pretty':
+        return json.dumps(doc, indent=4).encode('utf-8'), ContentSettings(content_type='application/json')
+    
+    data = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+
+    if output_format == 'gzip':
+        return gzip.compress(data), ContentSettings(content_type='application/json', content_encoding='gzip')
+
+    return data, ContentSettings(content_type='application/json')
+
+
+
+def decode_json_document(data):
+    ## gzip-compressed documents are recognized by their magic bytes, so all output formats read the same way
+    if isinstance(data, str): return json.loads(data)
+    if data[:2] == b'\x1f\x8b': data = gzip.decompress(data)
+    return json.loads(data.decode('utf-8'))
+
+
+
 def save_json_document(data_dict, container = OUTPUT_BLOB_CONTAINER):
 
     ret_dict = {}
 
-    new_doc = copy.deepcopy(data_dict)
+    ## shallow copy is enough, the document is only serialized
+    new_doc = {k: v for k, v in data_dict.items() if k != 'content'}
 
     new_doc['id'] = new_doc.get('id', str(uuid.uuid4()))
     new_doc['categoryId'] = CATEGORYID
     new_doc['timestamp']  = new_doc.get('timestamp', datetime.now().strftime("%m/%d/%Y, %H:%M:%S"))  
     new_doc['doc_url']    = new_doc.get('doc_url', f'https://microsoft.com/{str(uuid.uuid4())}')
-    
-    if 'content' in new_doc.keys():
-        del new_doc['content']
-
-    container_client = blob_service_client.get_container_client(container)
 
-    try:
-        container_properties = container_client.get_container_properties() 
-    except Exception as e:
-        container_client.create_container()
+    container_client = get_container_client(container)
 
     blob_name = urllib.parse.unquote(os.path.basename(new_doc['doc_url'].split('?')[0]))
     pre, ext = os.path.splitext(blob_name)
     blob_name = pre + '.json'            
     blob_client = container_client.get_blob_client(blob=blob_name)
-    blob_client.upload_blob(json.dumps(new_doc, indent=4), overwrite=True)
+    data, content_settings = encode_json_document(new_doc)
+    blob_client.upload_blob(data, overwrite=True, content_settings=content_settings)
     ret_dict['status'] = f"Document {new_doc['id']} was successfully saved to the {OUTPUT_BLOB_CONTAINER} container"
     logging.info(ret_dict['status'])
 
@@ -94,27 +161,33 @@ def save_json_document(data_dict, container = OUTPUT_BLOB_CONTAINER):
 
 
 
+def load_json_document(container, filename):
+    blob_client = get_blob_service_client().get_blob_client(container=container, blob=filename)
+    return decode_json_document(blob_client.download_blob().readall())
+
+
+
 
 def list_documents(container):
-    container_client = blob_service_client.get_container_client(container)
+    container_client = get_blob_service_client().get_container_client(container)
     generator = container_client.list_blobs()
     blobs = []
     for blob in generator:
-        blob_client = blob_service_client.get_blob_client(container=container, blob=blob.name)
+        blob_client = get_blob_service_client().get_blob_client(container=container, blob=blob.name)
         blobs.append(blob_client.url)
 
     return blobs
 
 
 def get_document_url(container, filename):
-    url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{container}/{filename}"
+    url = f"https://{get_blob_service_client().account_name}.blob.core.windows.net/{container}/{filename}"
     return requote_uri(url)
 
 
 def get_document(container, filename):
     
     transport_params = {
-        'client': blob_service_client
+        'client': get_blob_service_client()
     }
 
     with smart_open.open(f"azure://{container}/{filename}", transport_params=transport_params) as fin:
@@ -125,7 +198,7 @@ def get_document(container, filename):
 
 def download_document(url, as_text = True):
     
-    blob_client = blob_service_client.get_blob_client(container=container, blob=blob_name)
+    blob_client = get_blob_service_client().get_blob_client(container=container, blob=blob_name)
     blob_name = urllib.parse.unquote(os.path.basename(blob_path))
     container = get_container_name(blob_path)
     download_stream = blob_client.download_blob()
@@ -0,0 +1,61 @@
+import re
+
+
+## Shared text cleaning. Every pattern list is compiled once into a single alternation, so a text is
+## cleaned in one regex pass instead of one findall plus one str.replace scan per pattern.
+
+## Office / PowerPoint extraction artifacts left in cracked document text
+office_patterns = [
+    r"customXml\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*",
+    r"ppt\/[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*",
+    r"\.MsftOfcThm_[-a-zA-Z0-9+&@#\/%=~_|$?!:,.]*[\r\n\t\f\v ]\{[\r\n\t\f\v ].*[\r\n\t\f\v ]\}",
+    r"SlidePowerPoint",
+    r"PresentationPowerPoint",
+    r'[a-zA-Z0-9]*\.(?:gif|emf)'
+    ]
+
+
+## ReAct scaffolding that leaks into the final answer of the agents, longer alternatives first.
+## The first one drops an 'Action: <tool>' line together with the 'Action Input:' label that follows it.
+agent_patterns = [
+    r"Action:[\s\r\n]+(?:(?!Action:).)*?Action Input:",
+    r"Action Input:[\s\r\n]+",
+    r"Action:[\s\r\n]+None needed?.",
+    r"Action:[\s\r\n]+None?.",
+    r"Action:[\s\r\n]+",
+    r"Action [\d]+:",
+    r"Action Input:",
+    r"Online Search:",
+    r"Thought [0-9]+:",
+    r"Observation [0-9]+:",
+    r"Final Answer:",
+    r"Final Answer",
+    r"Finish\[",
+    r"Human:",
+    r"AI:",
+    r"--",
+    r"###"
+    ]
+
+
+
+def compile_patterns(patterns, flags = re.DOTALL):
+    return re.compile('|'.join([f"(?:{p})" for p in patterns]), flags)
+
+
+office_re = compile_patterns(office_patterns)
+agent_re = compile_patterns(agent_patterns)
+url_re = re.compile(r'(https|http)?:\/\/(\w|\.|\/|\?|\=|\&|\%)*\b', re.MULTILINE)
+
+
+
+def clean_office_text(text):
+    return office_re.sub('', text)
+
+
+def clean_agent_answer(answer):
+    return agent_re.sub('', answer)
+
+
+def remove_urls(text):
+    return url_re.sub('', text)
@@ -0,0 +1,132 @@
+## Benchmark of the compiled single-pass cleaner against the per-pattern findall / replace loop.
+##
+## python -m utils.text_cleaning_benchmark --slides 2000 --repeat 5
+## python -m utils.text_cleaning_benchmark --json processed_deck.json
+## python -m utils.text_cleaning_benchmark --check-agent
+##
+## Without --json a synthetic PowerPoint-derived text is generated, with the customXml/ppt part names,
+## theme blocks and image file names that the document cracking leaves in the extracted content.
+## --check-agent compares clean_agent_answer against the previous per-pattern agent cleaner on ReAct answers.
+
+import re
+import json
+import time
+import random
+import argparse
+
+from utils import text_cleaning
+
+
+
+def clean_text_per_pattern(text, patterns = text_cleaning.office_patterns):
+    for re_str in patterns:
+        matches = re.findall(re_str, text, re.DOTALL)
+        for m in matches: text = text.replace(m, '')
+    return text
+
+
+
+## the agent cleaner as it was in KMOAI_Agent.process_final_response, including the glued first pattern
+previous_agent_patterns = [
+    r"Action:[\n\r\s]+(.*?)[\n]*[\n\r\s](.*)" r"Action Input:[\s\r\n]+",
+    r"Action:[\s\r\n]+None needed?.",
+    r"Action:[\s\r\n]+None?.",
+    r"Action:[\s\r\n]+",
+    r"Action [\d]+:",
+    r"Action Input:",
+    r"Online Search:",
+    r"Thought [0-9]+:",
+    r"Observation [0-9]+:",
+    r"Final Answer:",
+    r"Final Answer",
+    r"Finish\[",
+    r"Human:",
+    r"AI:",
+    r"--",
+    r"###"
+    ]
+
+
+agent_answers = [
+    ("Thought 1: x\nAction: Search\nAction Input: foo bar\nObservation 1: y\nFinal Answer: z", ' x\n foo bar\n y\n z'),
+    ("Action: Search foo\nAction Input: bar baz", ' bar baz'),
+    ("Thought 2: done\nAction: None needed.\nFinal Answer: The revenue was 5M.", ' done\n\n The revenue was 5M.'),
+    ("Human: hi\nAI: hello -- ### there", ' hi\n hello   there')
+    ]
+
+
+
+def clean_agent_answer_per_pattern(answer, patterns = previous_agent_patterns):
+    for re_str in patterns:
+        for m in re.findall(re_str, answer, re.DOTALL):
+            if isinstance(m, tuple): m = ' '.join(m).rstrip()
+            answer = answer.replace(m, '')
+    return answer
+
+
+
+def check_agent_answers(cases = agent_answers):
+    ## returns the cases where either cleaner differs from the expected output, empty when equivalent
+    mismatches = []
+
+    for answer, expected in cases:
+        before = clean_agent_answer_per_pattern(answer)
+        after = text_cleaning.clean_agent_answer(answer)
+        if (before != expected) or (after != expected):
+            mismatches.append({'answer': answer, 'expected': expected, 'per_pattern': before, 'compiled': after})
+
+    return mismatches
+
+
+
+def generate_pptx_text(slides = 1000, seed = 42):
+    rng = random.Random(seed)
+    words = ['revenue', 'quarter', 'customer', 'growth', 'platform', 'roadmap', 'margin', 'pipeline', 'region', 'forecast']
+
+    parts = []
+    for i in range(slides):
+        parts.append(f"SlidePowerPoint Slide {i}")
+        parts.append(' '.join(rng.choice(words) for _ in range(rng.randint(40, 120))) + '.')
+        parts.append(f"ppt/slides/slide{i}.xml ppt/slides/_rels/slide{i}.xml.rels customXml/item{i % 7}.xml")
+        parts.append(f"image{i}.gif image{i}.emf")
+
+    parts.append("PresentationPowerPoint")
+    return '\n'.join(parts)
+
+
+
+def benchmark(text, repeat = 5):
+    results = {}
+
+    for name, func in [('per_pattern', clean_text_per_pattern), ('compiled', text_cleaning.clean_office_text)]:
+        start = time.perf_counter()
+        for _ in range(repeat): cleaned = func(text)
+        results[name] = {'secs': (time.perf_counter() - start) / repeat, 'chars_out': len(cleaned)}
+
+    results['chars_in'] = len(text)
+    results['speedup'] = results['per_pattern']['secs'] / max(results['compiled']['secs'], 1e-9)
+    return results
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the compiled text cleaner on PowerPoint-derived text')
+    parser.add_argument('--json', default='', help='processed JSON document, its content or text field is cleaned')
+    parser.add_argument('--slides', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check-agent', action='store_true', help='only check clean_agent_answer against the previous cleaner')
+    args = parser.parse_args()
+
+    if args.check_agent:
+        mismatches = check_agent_answers()
+        print(mismatches if len(mismatches) > 0 else f"clean_agent_answer matches the previous cleaner on {len(agent_answers)} answers")
+        raise SystemExit(1 if len(mismatches) > 0 else 0)
+
+    if args.json != '':
+        with open(args.json, 'r') as openfile:
+            doc = json.load(openfile)
+        text = doc.get('content', doc.get('text', ''))
+    else:
+        text = generate_pptx_text(args.slides)
+
+    print(benchmark(text, args.repeat))
@@ -0,0 +1,56 @@
+import numpy as np
+
+from utils.env_vars import *
+
+
+## Compact storage for the Redis vector index:
+##   REDIS_VECTOR_TYPE       FLOAT32 (default) or FLOAT16 (needs RediSearch 2.10+)
+##   REDIS_PROJECTION_DIMS   0 (default) keeps the model dimensions, otherwise a fixed random projection to this many dims
+
+projection_matrices = {}
+
+
+
+def get_numpy_dtype(vector_type = REDIS_VECTOR_TYPE):
+    if vector_type == 'FLOAT16':
+        return np.float16
+    elif vector_type == 'FLOAT32':
+        return np.float32
+    else:
+        assert False, f"Vector type unknown {vector_type}"
+
+
+
+def get_index_dims(model_dims, projection_dims = REDIS_PROJECTION_DIMS):
+    if projection_dims > 0: return projection_dims
+    return model_dims
+
+
+
+def get_projection_matrix(input_dims, projection_dims, seed = REDIS_PROJECTION_SEED):
+    key = (input_dims, projection_dims, seed)
+
+    if key not in projection_matrices:
+        rng = np.random.default_rng(seed)
+        projection_matrices[key] = rng.standard_normal((input_dims, projection_dims)).astype(np.float32) / np.sqrt(projection_dims)
+
+    return projection_matrices[key]
+
+
+
+def compact_vectors(matrix, vector_type = REDIS_VECTOR_TYPE, projection_dims = REDIS_PROJECTION_DIMS):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    single = (matrix.ndim == 1)
+    if single: matrix = matrix.reshape(1, -1)
+
+    if projection_dims > 0:
+        matrix = matrix @ get_projection_matrix(matrix.shape[1], projection_dims)
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    matrix = matrix.astype(get_numpy_dtype(vector_type))
+    return matrix[0] if single else matrix
+
+
+
+def vector_to_bytes(vector, vector_type = REDIS_VECTOR_TYPE, projection_dims = REDIS_PROJECTION_DIMS):
+    return compact_vectors(vector, vector_type, projection_dims).tobytes()
@@ -0,0 +1,90 @@
+## Offline recall@k check of the compact Redis vector modes against the float32 baseline.
+##
+## python -m utils.vector_recall --pkl emb_documents.pkl --k 10 --queries 200
+## python -m utils.vector_recall --cosmos --limit 20000 --projections 256,512,768
+##
+## The corpus vectors double as queries: for every sampled chunk the exact float32 cosine top-k
+## (excluding the chunk itself) is compared with the top-k computed on the compacted vectors.
+
+import argparse
+import pickle
+import numpy as np
+
+from utils import vector_quantization
+from utils.env_vars import *
+
+
+
+def load_vectors_from_pkl(filename):
+    with open(filename, 'rb') as pickle_in:
+        emb_documents = pickle.load(pickle_in)
+
+    return np.asarray([e[VECTOR_FIELD_IN_REDIS] for e in emb_documents if len(e.get(VECTOR_FIELD_IN_REDIS, [])) > 0], dtype=np.float32)
+
+
+
+def load_vectors_from_cosmos(limit = -1):
+    from utils import cosmos_helpers
+
+    vectors = []
+    for page in cosmos_helpers.cosmos_read_embedding_pages():
+        vectors += [e[VECTOR_FIELD_IN_REDIS] for e in page if len(e.get(VECTOR_FIELD_IN_REDIS, [])) > 0]
+        if (limit != -1) and (len(vectors) >= limit): break
+
+    return np.asarray(vectors if limit == -1 else vectors[:limit], dtype=np.float32)
+
+
+
+def top_k(corpus, query_ids, k):
+    corpus = corpus.astype(np.float32)
+    corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+
+    scores = corpus[query_ids] @ corpus.T
+    scores[np.arange(len(query_ids)), query_ids] = -np.inf
+
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+
+def measure_recall(vectors, k = 10, num_queries = 200, vector_types = ['FLOAT32', 'FLOAT16'], projections = [0], seed = REDIS_PROJECTION_SEED):
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+
+    baseline = top_k(vectors, query_ids, k)
+    results = []
+
+    for projection_dims in projections:
+        for vector_type in vector_types:
+            compact = vector_quantization.compact_vectors(vectors, vector_type, projection_dims)
+            candidate = top_k(compact, query_ids, k)
+
+            recall = np.mean([len(b & c) / k for b, c in zip(baseline, candidate)])
+            results.append({
+                'vector_type': vector_type,
+                'dims': compact.shape[1],
+                'bytes_per_vector': compact.shape[1] * compact.dtype.itemsize,
+                f'recall@{k}': float(recall)
+            })
+
+    return results
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure recall@k of compact Redis vector storage against float32')
+    parser.add_argument('--pkl', default='', help='pickle of emb_documents as written by helpers.save_object_to_pkl')
+    parser.add_argument('--cosmos', action='store_true', help='read the embeddings backed up in Cosmos instead')
+    parser.add_argument('--limit', type=int, default=-1)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--projections', default='0', help='comma separated projection dims, 0 keeps the model dims')
+    args = parser.parse_args()
+
+    vectors = load_vectors_from_cosmos(args.limit) if args.cosmos else load_vectors_from_pkl(args.pkl)
+    projections = [int(p) for p in args.projections.split(',')]
+
+    print(f"Loaded {len(vectors)} vectors of {vectors.shape[1]} dims")
+
+    for r in measure_recall(vectors, args.k, args.queries, projections=projections):
+        print(r)